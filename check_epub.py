@@ -2,6 +2,7 @@
 """
 验证生成的 EPUB 文件是否有效的脚本
 """
+import os
 import sys
 import zipfile
 from pathlib import Path
@@ -49,30 +50,25 @@ def check_epub(epub_path):
                 else:
                     print(f"  ❌ {required} (缺少)")
             
-            # 尝试读取 package.opf
+            # 尝试读取 package.opf（流式解析，只确认格式正确，不构建完整 DOM）
             try:
                 with zip_file.open('META-INF/package.opf') as f:
-                    opf_content = f.read()
-                    root = ET.fromstring(opf_content)
-                    print(f"\n✓ 成功解析 package.opf")
-                    print(f"  文件大小: {len(opf_content)} 字节")
+                    for _event, elem in ET.iterparse(f, events=('end',)):
+                        elem.clear()
+                print(f"\n✓ 成功解析 package.opf")
+                print(f"  文件大小: {zip_file.getinfo('META-INF/package.opf').file_size} 字节")
             except Exception as e:
                 print(f"\n❌ 无法解析 package.opf: {e}")
                 return False
             
-            # 尝试列出 XHTML 文件
-            xhtml_files = [f for f in file_list if f.endswith('.xhtml') or f.endswith('.html')]
+            # 尝试列出 XHTML 文件（大小取自中央目录，无需解压）
+            xhtml_infos = [i for i in zip_file.infolist() if i.filename.endswith(('.xhtml', '.html'))]
             print(f"\n包含的内容文件:")
-            if xhtml_files:
-                for xhtml in xhtml_files[:5]:  # 只显示前 5 个
-                    try:
-                        with zip_file.open(xhtml) as f:
-                            content = f.read()
-                            print(f"  ✓ {xhtml} ({len(content)} 字节)")
-                    except Exception as e:
-                        print(f"  ❌ {xhtml}: {e}")
-                if len(xhtml_files) > 5:
-                    print(f"  ... 以及其他 {len(xhtml_files) - 5} 个文件")
+            if xhtml_infos:
+                for info in xhtml_infos[:5]:  # 只显示前 5 个
+                    print(f"  ✓ {info.filename} ({info.file_size} 字节)")
+                if len(xhtml_infos) > 5:
+                    print(f"  ... 以及其他 {len(xhtml_infos) - 5} 个文件")
             else:
                 print("  ❌ 没有找到 XHTML 文件!")
                 return False
@@ -86,6 +82,28 @@ def check_epub(epub_path):
         print(f"❌ 检查失败: {e}")
         return False
 
+def _scan_epubs(path):
+    """
+    递归遍历目录，产出 .epub 文件的 DirEntry（复用 scandir 缓存的元数据）；
+    无权限或已消失的目录直接跳过（临时目录中常有其他用户的 tmp* 目录）
+    """
+    try:
+        it = os.scandir(path)
+    except OSError:
+        return
+    with it:
+        for entry in it:
+            try:
+                if entry.is_symlink():
+                    continue
+                if entry.is_dir():
+                    yield from _scan_epubs(entry.path)
+                elif entry.name.endswith('.epub'):
+                    yield entry
+            except OSError:
+                continue
+
+
 if __name__ == "__main__":
     # 查找最近的 EPUB 文件
     from datetime import datetime
@@ -96,20 +114,24 @@ if __name__ == "__main__":
     
     print("搜索 EPUB 文件...\n")
     
-    epub_files = []
-    for temp_subdir in temp_dir.glob('tmp*'):
-        if temp_subdir.is_dir():
-            for epub in temp_subdir.rglob('*.epub'):
-                mtime = epub.stat().st_mtime
-                epub_files.append((mtime, epub))
+    # 边扫描边取最新的 EPUB 文件，无需排序整个列表
+    latest = None
+    with os.scandir(temp_dir) as it:
+        for temp_subdir in it:
+            if temp_subdir.name.startswith('tmp') and temp_subdir.is_dir():
+                for epub in _scan_epubs(temp_subdir.path):
+                    try:
+                        mtime = epub.stat().st_mtime
+                    except OSError:
+                        continue
+                    if latest is None or mtime > latest[0]:
+                        latest = (mtime, Path(epub.path))
     
-    if epub_files:
-        # 获取最新的 EPUB 文件
-        epub_files.sort(reverse=True)
-        latest_epub = epub_files[0][1]
+    if latest is not None:
+        latest_mtime, latest_epub = latest
         
         print(f"最新的 EPUB 文件: {latest_epub}")
-        print(f"修改时间: {datetime.fromtimestamp(epub_files[0][0])}\n")
+        print(f"修改时间: {datetime.fromtimestamp(latest_mtime)}\n")
         
         success = check_epub(latest_epub)
         
@@ -1,289 +1,272 @@
 from pathlib import Path
-import re
-from ebooklib import epub
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+import collections
+import logging
+import os
+import uuid
+import zipfile
 from lxml import etree
 
 from .models import PageContent, TextBlock, FormulaBlock
 
+logger = logging.getLogger(__name__)
 
-class EPUBBuilder:
-    def __init__(self, title: str, author: str):
-        self._book = epub.EpubBook()
-        self._book.set_title(title)
-        self._book.add_author(author)
-        self._book.set_language("zh")
-        self._chapters: list[epub.EpubHtml] = []
+# 章节：xhtml 为已编码的 UTF-8 bytes
+_Chapter = collections.namedtuple("_Chapter", "title file_name xhtml")
 
-    def add_page(self, page: PageContent) -> None:
-        body_parts: list[str] = []
+# 校验 XHTML 用的解析器，模块级复用；严格模式（不 recover），格式错误会被发现；
+# 不加载 DTD、不访问网络
+_XHTML_PARSER = etree.XMLParser(
+    resolve_entities=False,
+    load_dtd=False,
+    no_network=True,
+)
 
-        for block in page.blocks:
-            if isinstance(block, TextBlock):
-                text = block.content.strip()
-                if text:
-                    body_parts.append(f"<p>{text}</p>")
+# 页面 XHTML 模板按页码与正文两个变量预先切成 bytes 片段，
+# 每页只需一次 b"".join，无需格式化整份模板再编码
+_PAGE_HEAD = (
+    b"<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
+    b"<!DOCTYPE html>\n"
+    b"<html xmlns=\"http://www.w3.org/1999/xhtml\">\n"
+    b"<head>\n"
+    b"  <title>Page "
+)
+_PAGE_MID = (
+    b"</title>\n"
+    b"  <meta charset=\"utf-8\" />\n"
+    b"</head>\n"
+    b"<body>\n"
+)
+_PAGE_TAIL = (
+    b"\n"
+    b"</body>\n"
+    b"</html>"
+)
+_TEXT_TMPL = "<p>{}</p>"
+# ⚠️ 公式暂时包在 div 中，避免 lxml namespace 解析炸掉
+_FORMULA_TMPL = "<div class='formula'><math xmlns='http://www.w3.org/1998/Math/MathML'>{}</math></div>"
+# XML 1.0 不允许的码位（pdfminer / OCR 文本中常见 \x0c、\x00 等控制字符）：
+# 换页、垂直制表符替换为空格，其余直接删除，避免整页校验失败
+_XML_ILLEGAL = {
+    code: None
+    for code in (
+        *range(0x00, 0x09), *range(0x0E, 0x20),
+        *range(0xD800, 0xE000), 0xFFFE, 0xFFFF,
+    )
+}
+_XML_ILLEGAL.update({0x0B: " ", 0x0C: " "})
 
-            elif isinstance(block, FormulaBlock):
-                formula = block.content.strip()
-                if formula:
-                    # ⚠️ 暂时包在 div 中，避免 lxml namespace 解析炸掉
-                    body_parts.append(
-                        "<div class='formula'>"
-                        f"<math xmlns='http://www.w3.org/1998/Math/MathML'>{formula}</math>"
-                        "</div>"
-                    )
 
-        # 🚨 强制兜底：绝不允许空 body
-        # 使用可见文本作为占位符，避免 lxml 解析错误（空文档错误）
-        if not body_parts:
-            body_parts.append("<p>（此页无内容）</p>")
+def _xml_text(content: str) -> str:
+    """去除 XML 非法字符并转义（<、>、&）"""
+    return escape(content.translate(_XML_ILLEGAL))
 
-        body_html = "\n".join(body_parts)
-        
-        # 验证 body_html 不为空（去除空白字符后）
-        # 如果只有空白字符，使用占位符
-        if not body_html.strip() or len(body_html.strip()) < 10:
-            body_parts = ["<p>（此页无内容）</p>"]
-            body_html = "\n".join(body_parts)
 
-        xhtml = (
-            "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
-            "<!DOCTYPE html>\n"
-            "<html xmlns=\"http://www.w3.org/1999/xhtml\">\n"
-            "<head>\n"
-            f"  <title>Page {page.page_number}</title>\n"
-            "  <meta charset=\"utf-8\" />\n"
-            "</head>\n"
-            "<body>\n"
-            f"{body_html}\n"
-            "</body>\n"
-            "</html>"
-        )
-        
-        # 使用 lxml 验证 XHTML 内容，确保它可以被正确解析且 body 不为空
-        try:
-            parser = etree.XMLParser(recover=True)
-            tree = etree.fromstring(xhtml.encode('utf-8'), parser=parser)
-            # 检查 body 标签是否有内容（子元素或文本）
-            body_elements = tree.xpath('//xhtml:body', namespaces={'xhtml': 'http://www.w3.org/1999/xhtml'})
-            if not body_elements:
-                # 没有找到 body 标签，使用占位符
-                raise ValueError("No body element found")
-            
-            body = body_elements[0]
-            # 检查 body 是否有子元素或文本内容
-            has_children = len(body) > 0
-            has_text = body.text and body.text.strip()
-            has_tail = any(child.tail and child.tail.strip() for child in body)
-            
-            if not (has_children or has_text or has_tail):
-                # body 为空，使用占位符
-                xhtml = (
-                    "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
-                    "<!DOCTYPE html>\n"
-                    "<html xmlns=\"http://www.w3.org/1999/xhtml\">\n"
-                    "<head>\n"
-                    f"  <title>Page {page.page_number}</title>\n"
-                    "  <meta charset=\"utf-8\" />\n"
-                    "</head>\n"
-                    "<body><p>（此页无内容）</p></body>\n"
-                    "</html>"
-                )
-        except Exception as e:
-            # 如果解析失败或 body 为空，使用最小有效内容
-            print(f"Warning: Failed to validate XHTML for page {page.page_number}: {e}")
-            xhtml = (
-                "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
-                "<!DOCTYPE html>\n"
-                "<html xmlns=\"http://www.w3.org/1999/xhtml\">\n"
-                "<head>\n"
-                f"  <title>Page {page.page_number}</title>\n"
-                "  <meta charset=\"utf-8\" />\n"
-                "</head>\n"
-                "<body><p>（此页无内容）</p></body>\n"
-                "</html>"
-            )
+# 按块类型（精确匹配）分派到对应的格式化函数
+_FORMATTERS = {
+    TextBlock: lambda content: _TEXT_TMPL.format(_xml_text(content)),
+    FormulaBlock: lambda content: _FORMULA_TMPL.format(_xml_text(content)),
+}
+_EMPTY_BODY = "<p>（此页无内容）</p>".encode("utf-8")
 
-        # 创建章节并添加到书籍和章节列表
-        chapter = epub.EpubHtml(
-            title=f"Page {page.page_number}",
-            file_name=f"page_{page.page_number}.xhtml",
-            content=xhtml,
-        )
+_CONTAINER_XML = (
+    '<?xml version="1.0" encoding="utf-8"?>\n'
+    '<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container" version="1.0">\n'
+    '  <rootfiles>\n'
+    '    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>\n'
+    '  </rootfiles>\n'
+    '</container>\n'
+)
+
+
+def _item_id(chapter: _Chapter) -> str:
+    """清单 id：去掉扩展名的文件名"""
+    return chapter.file_name.rsplit(".", 1)[0]
+
+
+def _emit(page_number: int, body: bytes) -> bytes:
+    """拼接页面 XHTML"""
+    return b"".join((_PAGE_HEAD, str(page_number).encode("ascii"), _PAGE_MID, body, _PAGE_TAIL))
+
+
+def _render_page(page: PageContent) -> tuple[int, bytes]:
+    """
+    将单页渲染为已编码的 XHTML（纯函数，可在子进程中执行）
+
+    Returns:
+        (page_number, xhtml_bytes)
+    """
+    body_parts: list[bytes] = []
+
+    for block in page.blocks:
+        # 块内容在构造时已去除首尾空白
+        fmt = _FORMATTERS.get(type(block))
+        if fmt is not None and block.content:
+            body_parts.append(fmt(block.content).encode("utf-8"))
+
+    # 🚨 强制兜底：绝不允许空 body
+    # 使用可见文本作为占位符，避免 lxml 解析错误（空文档错误）
+    body_html = b"\n".join(body_parts) if body_parts else _EMPTY_BODY
+
+    xhtml = _emit(page.page_number, body_html)
+    
+    # 使用 lxml 验证 XHTML 内容，确保它可以被正确解析且 body 不为空
+    try:
+        tree = etree.fromstring(xhtml, parser=_XHTML_PARSER)
+        # 检查 body 标签是否有内容（子元素或文本）
+        body_elements = tree.xpath('//xhtml:body', namespaces={'xhtml': 'http://www.w3.org/1999/xhtml'})
+        if not body_elements:
+            # 没有找到 body 标签，使用占位符
+            raise ValueError("No body element found")
         
-        # 立即验证 get_body_content() 是否返回有效内容
-        try:
-            body_content = chapter.get_body_content()
-            if not body_content or not body_content.strip():
-                # 如果 get_body_content() 返回空，说明 XHTML 格式可能有问题
-                # 使用更简单的格式重新创建
-                print(f"Warning: Page {page.page_number} get_body_content() returns empty, using simpler format")
-                xhtml = (
-                    "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
-                    "<!DOCTYPE html>\n"
-                    "<html xmlns=\"http://www.w3.org/1999/xhtml\">\n"
-                    "<head>\n"
-                    f"  <title>Page {page.page_number}</title>\n"
-                    "  <meta charset=\"utf-8\" />\n"
-                    "</head>\n"
-                    "<body><p>（此页无内容）</p></body>\n"
-                    "</html>"
-                )
-                chapter.set_content(xhtml)
-                # 再次验证
-                body_content = chapter.get_body_content()
-                if not body_content or not body_content.strip():
-                    print(f"Error: Page {page.page_number} get_body_content() still returns empty after fix")
-        except Exception as e:
-            print(f"Warning: Failed to verify get_body_content() for page {page.page_number}: {e}")
+        body = body_elements[0]
+        # 检查 body 是否有子元素或文本内容
+        has_children = len(body) > 0
+        has_text = body.text and body.text.strip()
+        has_tail = any(child.tail and child.tail.strip() for child in body)
+        
+        if not (has_children or has_text or has_tail):
+            # body 为空，使用占位符
+            xhtml = _emit(page.page_number, _EMPTY_BODY)
+    except Exception as e:
+        # 如果解析失败或 body 为空，使用最小有效内容
+        logger.warning("Failed to validate XHTML for page %d: %s", page.page_number, e)
+        xhtml = _emit(page.page_number, _EMPTY_BODY)
+
+    return page.page_number, xhtml
+
+
+class EPUBBuilder:
+    def __init__(self, title: str, author: str):
+        self._title = title
+        self._author = author
+        self._language = "zh"
+        self._identifier = f"urn:uuid:{uuid.uuid4()}"
+        self._modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        # 按添加顺序即阅读顺序
+        self._chapters: list[_Chapter] = []
+        self._file_names: set[str] = set()
+
+    def add_page(self, page: PageContent) -> None:
+        if self._is_duplicate(page.page_number):
+            return
+        page_number, xhtml = _render_page(page)
+        self._add_chapter(page_number, xhtml)
+
+    def _is_duplicate(self, page_number: int) -> bool:
+        # 同一页码重复添加会产生重名的 ZIP 条目和清单 id，只保留第一次
+        if f"page_{page_number}.xhtml" in self._file_names:
+            logger.warning("Page %d already added to EPUB, skipping", page_number)
+            return True
+        return False
 
-        self._book.add_item(chapter)
-        self._chapters.append(chapter)
+    def _add_chapter(self, page_number: int, xhtml: bytes) -> None:
+        file_name = f"page_{page_number}.xhtml"
+        self._chapters.append(_Chapter(
+            title=f"Page {page_number}",
+            file_name=file_name,
+            xhtml=xhtml,
+        ))
+        self._file_names.add(file_name)
 
     def build(self, output_path: Path) -> None:
         # 确保至少有一个章节
         if not self._chapters:
             raise RuntimeError("No chapters added to EPUB")
 
-        # 在写入前验证所有章节的内容，确保 get_body_content() 返回有效内容
-        # 这是关键：ebooklib 在生成导航时会调用 get_body_content()，如果返回空就会报错
-        # 使用更简单的 XHTML 格式，确保 get_body_content() 能正确提取 body 内容
-        minimal_xhtml_template = (
+        # 直接写出 ZIP：mimetype 必须是第一个条目且不压缩
+        # 每页 XHTML 都很小，compresslevel=1 压缩率损失很少但明显更快
+        # 先写临时文件再原子替换：已有的硬链接（如预览目录）始终指向完整的旧文件
+        output_path = Path(output_path)
+        tmp_path = output_path.with_name(output_path.name + ".tmp")
+        try:
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+                zf.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+                zf.writestr("META-INF/container.xml", _CONTAINER_XML)
+                zf.writestr("OEBPS/content.opf", self._render_opf())
+                zf.writestr("OEBPS/toc.ncx", self._render_ncx())
+                zf.writestr("OEBPS/nav.xhtml", self._render_nav())
+                for chapter in self._chapters:
+                    zf.writestr(f"OEBPS/{chapter.file_name}", chapter.xhtml)
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def _render_opf(self) -> str:
+        """生成 content.opf（元数据 + 清单 + 阅读顺序）"""
+        manifest_items = "\n".join(
+            f'    <item id="{_item_id(c)}" href="{c.file_name}" media-type="application/xhtml+xml"/>'
+            for c in self._chapters
+        )
+        spine_items = "\n".join(
+            f'    <itemref idref="{_item_id(c)}"/>' for c in self._chapters
+        )
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id">\n'
+            '  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+            f'    <dc:identifier id="id">{self._identifier}</dc:identifier>\n'
+            f'    <dc:title>{escape(self._title)}</dc:title>\n'
+            f'    <dc:creator>{escape(self._author)}</dc:creator>\n'
+            f'    <dc:language>{self._language}</dc:language>\n'
+            f'    <meta property="dcterms:modified">{self._modified}</meta>\n'
+            '  </metadata>\n'
+            '  <manifest>\n'
+            '    <item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>\n'
+            '    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>\n'
+            f'{manifest_items}\n'
+            '  </manifest>\n'
+            '  <spine toc="ncx">\n'
+            '    <itemref idref="nav"/>\n'
+            f'{spine_items}\n'
+            '  </spine>\n'
+            '</package>\n'
+        )
+
+    def _render_ncx(self) -> str:
+        """生成 EPUB2 兼容的 toc.ncx"""
+        nav_points = "\n".join(
+            f'    <navPoint id="{_item_id(c)}" playOrder="{order}">\n'
+            f'      <navLabel><text>{c.title}</text></navLabel>\n'
+            f'      <content src="{c.file_name}"/>\n'
+            '    </navPoint>'
+            for order, c in enumerate(self._chapters, start=1)
+        )
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">\n'
+            '  <head>\n'
+            f'    <meta name="dtb:uid" content="{self._identifier}"/>\n'
+            '  </head>\n'
+            f'  <docTitle><text>{escape(self._title)}</text></docTitle>\n'
+            '  <navMap>\n'
+            f'{nav_points}\n'
+            '  </navMap>\n'
+            '</ncx>\n'
+        )
+
+    def _render_nav(self) -> str:
+        """生成 EPUB3 导航文档 nav.xhtml"""
+        nav_items = "\n".join(
+            f'      <li><a href="{c.file_name}">{c.title}</a></li>'
+            for c in self._chapters
+        )
+        return (
             '<?xml version="1.0" encoding="utf-8"?>\n'
             '<!DOCTYPE html>\n'
-            '<html xmlns="http://www.w3.org/1999/xhtml">\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
             '<head>\n'
-            '  <title>{title}</title>\n'
-            '  <meta charset="utf-8"/>\n'
+            f'  <title>{escape(self._title)}</title>\n'
+            '  <meta charset="utf-8" />\n'
             '</head>\n'
             '<body>\n'
-            '  <p>（此页无内容）</p>\n'
+            '  <nav epub:type="toc" id="toc">\n'
+            '    <ol>\n'
+            f'{nav_items}\n'
+            '    </ol>\n'
+            '  </nav>\n'
             '</body>\n'
-            '</html>'
+            '</html>\n'
         )
-        
-        # 直接测试每个章节的 get_body_content()，这是 ebooklib 实际使用的方法
-        chapters_to_recreate = []
-        
-        for chapter in list(self._chapters):  # 使用 list() 创建副本，避免在迭代时修改
-            try:
-                body_content = chapter.get_body_content()
-                if not body_content or not body_content.strip():
-                    # get_body_content() 返回空，需要修复
-                    print(f"Warning: Chapter {chapter.file_name} get_body_content() returns empty, will recreate")
-                    chapters_to_recreate.append(chapter)
-            except Exception as e:
-                # 如果调用 get_body_content() 时出错，也需要修复
-                print(f"Warning: Failed to call get_body_content() for {chapter.file_name}: {e}, will recreate")
-                chapters_to_recreate.append(chapter)
-        
-        # 重新创建所有有问题的章节
-        for chapter in chapters_to_recreate:
-            minimal_xhtml = minimal_xhtml_template.format(title=chapter.title)
-            
-            # 移除旧章节
-            if chapter in self._book.items:
-                self._book.items.remove(chapter)
-            if chapter in self._chapters:
-                self._chapters.remove(chapter)
-            
-            # 创建新章节，使用已知有效的格式
-            new_chapter = epub.EpubHtml(
-                title=chapter.title,
-                file_name=chapter.file_name,
-                content=minimal_xhtml,
-            )
-            
-            # 立即验证新章节的 get_body_content() 是否返回有效内容
-            try:
-                body_content = new_chapter.get_body_content()
-                if not body_content or not body_content.strip():
-                    # 如果仍然为空，尝试使用 set_content
-                    print(f"Warning: New chapter {new_chapter.file_name} get_body_content() still empty, trying set_content")
-                    new_chapter.set_content(minimal_xhtml)
-                    body_content = new_chapter.get_body_content()
-                    if not body_content or not body_content.strip():
-                        print(f"Error: Chapter {new_chapter.file_name} get_body_content() still returns empty!")
-            except Exception as e:
-                print(f"Warning: Failed to verify new chapter {new_chapter.file_name}: {e}")
-            
-            self._book.add_item(new_chapter)
-            self._chapters.append(new_chapter)
-        
-        # 最终验证：确保所有章节的 get_body_content() 都返回有效内容
-        print(f"Final validation: Checking {len(self._chapters)} chapters...")
-        final_fixes = []
-        for chapter in list(self._chapters):
-            try:
-                body_content = chapter.get_body_content()
-                if not body_content or not body_content.strip():
-                    print(f"ERROR: Chapter {chapter.file_name} get_body_content() still returns empty in final check!")
-                    final_fixes.append(chapter)
-            except Exception as e:
-                print(f"ERROR: Failed to get_body_content() for {chapter.file_name} in final check: {e}")
-                final_fixes.append(chapter)
-        
-        # 如果有章节在最终检查中仍然失败，完全重新创建它们
-        # 使用一个已知可以工作的简单 XHTML 格式
-        simple_xhtml = (
-            '<?xml version="1.0" encoding="utf-8"?>\n'
-            '<!DOCTYPE html>\n'
-            '<html xmlns="http://www.w3.org/1999/xhtml">\n'
-            '<head><title>Page</title><meta charset="utf-8"/></head>\n'
-            '<body><p>Content</p></body>\n'
-            '</html>'
-        )
-        
-        for chapter in final_fixes:
-            # 完全移除旧章节
-            if chapter in self._book.items:
-                self._book.items.remove(chapter)
-            if chapter in self._chapters:
-                self._chapters.remove(chapter)
-            
-            # 创建全新的章节，使用最简单的格式
-            new_chapter = epub.EpubHtml(
-                title=chapter.title,
-                file_name=chapter.file_name,
-                content=simple_xhtml.replace('Page', chapter.title).replace('Content', '（此页无内容）'),
-            )
-            
-            # 多次尝试设置内容，确保被正确设置
-            content_str = simple_xhtml.replace('Page', chapter.title).replace('Content', '（此页无内容）')
-            new_chapter.set_content(content_str)
-            
-            # 尝试直接设置内部属性
-            try:
-                if hasattr(new_chapter, 'content'):
-                    new_chapter.content = content_str.encode('utf-8') if isinstance(content_str, str) else content_str
-            except:
-                pass
-            
-            try:
-                if hasattr(new_chapter, '_content'):
-                    new_chapter._content = content_str.encode('utf-8') if isinstance(content_str, str) else content_str
-            except:
-                pass
-            
-            # 添加到书籍和章节列表
-            self._book.add_item(new_chapter)
-            self._chapters.append(new_chapter)
-            
-            # 最后验证
-            try:
-                body_content = new_chapter.get_body_content()
-                if body_content and body_content.strip():
-                    print(f"Success: Chapter {new_chapter.file_name} get_body_content() now returns content")
-                else:
-                    print(f"Warning: Chapter {new_chapter.file_name} get_body_content() still returns empty after all fixes")
-            except Exception as e:
-                print(f"Warning: Failed to verify {new_chapter.file_name}: {e}")
-
-        # 使用所有已添加的章节
-        self._book.toc = self._chapters
-        self._book.spine = ["nav"] + self._chapters
-
-        self._book.add_item(epub.EpubNcx())
-        self._book.add_item(epub.EpubNav())
-
-        epub.write_epub(output_path, self._book)
@@ -1,27 +1,33 @@
 # core/formula_extractor.py
 import re
+from typing import List, Tuple
 from .models import PageContent, FormulaBlock, TextBlock
 
 
+# 常见数学符号
+_MATH_CHARS = frozenset('∑∫√≤≥≠±×÷αβγπθλμσ∞∂')
+
+
 class FormulaExtractor:
     """数学公式提取器 - 从文本中识别和提取数学公式"""
     
     def __init__(self):
         # 数学公式模式（LaTeX、MathML、或数学符号）
-        self._math_patterns = [
-            r'\$[^$]+\$',  # LaTeX内联公式 $...$
-            r'\$\$[^$]+\$\$',  # LaTeX块级公式 $$...$$
-            r'\\begin\{equation\}.*?\\end\{equation\}',  # LaTeX equation环境
-            r'\\begin\{align\}.*?\\end\{align\}',  # LaTeX align环境
-            r'\\begin\{matrix\}.*?\\end\{matrix\}',  # LaTeX matrix环境
-        ]
+        # 合并为一个交替模式，每个文本块只扫描一遍；$$ 必须排在 $ 之前
+        self._formula_re = re.compile(
+            r'(?P<block>\$\$[^$]+\$\$)'  # LaTeX块级公式 $$...$$
+            r'|(?P<inline>\$[^$]+\$)'  # LaTeX内联公式 $...$
+            r'|(?P<equation>\\begin\{equation\}.*?\\end\{equation\})'  # LaTeX equation环境
+            r'|(?P<align>\\begin\{align\}.*?\\end\{align\})'  # LaTeX align环境
+            r'|(?P<matrix>\\begin\{matrix\}.*?\\end\{matrix\})',  # LaTeX matrix环境
+            re.DOTALL,
+        )
         
-        # 数学符号模式（用于检测可能的公式）
+        # 数学符号模式（用于检测可能的公式），常见数学符号见 _MATH_CHARS
         self._math_symbols = [
-            r'[∑∫√≤≥≠±×÷αβγπθλμσ∞∂]',  # 常见数学符号
-            r'\\[a-zA-Z]+\{',  # LaTeX命令
-            r'\^\{[^}]+\}',  # 上标
-            r'_\{[^}]+\}',  # 下标
+            re.compile(r'\\[a-zA-Z]+\{'),  # LaTeX命令
+            re.compile(r'\^\{[^}]+\}'),  # 上标
+            re.compile(r'_\{[^}]+\}'),  # 下标
         ]
 
     def extract(self, page: PageContent) -> PageContent:
@@ -40,41 +46,35 @@ class FormulaExtractor:
             if isinstance(block, TextBlock):
                 text = block.content
                 
-                # 检测并提取LaTeX公式
-                formulas_found = False
-                remaining_text = text
+                # 先收集公式区间，再按区间对原文切片生成块
+                spans = self._find_formula_spans(text)
+                last_end = 0
                 
-                # 查找所有可能的公式
-                for pattern in self._math_patterns:
-                    matches = re.finditer(pattern, text, re.DOTALL)
-                    last_end = 0
+                for start, end, kind in spans:
+                    # 添加公式前的文本
+                    before_text = text[last_end:start].strip()
+                    if before_text:
+                        new_blocks.append(TextBlock(content=before_text))
                     
-                    for match in matches:
-                        # 添加公式前的文本
-                        before_text = remaining_text[last_end:match.start()].strip()
-                        if before_text:
-                            new_blocks.append(TextBlock(content=before_text))
-                        
-                        # 添加公式
-                        formula_text = match.group(0)
-                        # 清理LaTeX标记
-                        if formula_text.startswith('$$'):
-                            formula_text = formula_text[2:-2]
-                        elif formula_text.startswith('$'):
-                            formula_text = formula_text[1:-1]
-                        
-                        new_blocks.append(FormulaBlock(content=formula_text, inline=True))
-                        formulas_found = True
-                        last_end = match.end()
+                    # 添加公式，清理LaTeX标记
+                    if kind == 'block':
+                        formula_text = text[start + 2:end - 2]
+                    elif kind == 'inline':
+                        formula_text = text[start + 1:end - 1]
+                    else:
+                        formula_text = text[start:end]
                     
-                    if formulas_found:
-                        # 添加剩余的文本
-                        remaining_text = remaining_text[last_end:]
+                    new_blocks.append(FormulaBlock(content=formula_text, inline=(kind == 'inline')))
+                    last_end = end
                 
                 # 如果没有找到标准格式的公式，尝试检测包含数学符号的文本
-                if not formulas_found:
+                if not spans:
                     # 检查是否包含数学符号
-                    has_math = any(re.search(pattern, text) for pattern in self._math_symbols)
+                    # 单字符用集合判断；其余模式都含 "{"，没有 "{" 时无需进入正则
+                    has_math = (
+                        not _MATH_CHARS.isdisjoint(text)
+                        or ('{' in text and any(pattern.search(text) for pattern in self._math_symbols))
+                    )
                     if has_math:
                         # 可能是公式，但格式不标准
                         # 可以尝试转换为LaTeX或保持原样
@@ -82,9 +82,9 @@ class FormulaExtractor:
                     else:
                         # 普通文本
                         new_blocks.append(block)
-                elif remaining_text.strip():
+                elif text[last_end:].strip():
                     # 还有剩余文本
-                    new_blocks.append(TextBlock(content=remaining_text.strip()))
+                    new_blocks.append(TextBlock(content=text[last_end:].strip()))
             else:
                 # 非文本块（如已经是公式块），直接添加
                 new_blocks.append(block)
@@ -93,4 +93,17 @@ class FormulaExtractor:
         if not new_blocks:
             new_blocks = page.blocks
         
-        return PageContent(page_number=page.page_number, blocks=new_blocks)
\ No newline at end of file
+        return PageContent(page_number=page.page_number, blocks=new_blocks)
+
+    def _find_formula_spans(self, text: str) -> List[Tuple[int, int, str]]:
+        """
+        按出现顺序返回文本中的公式区间
+        
+        Returns:
+            [(start, end, kind), ...]，kind 为匹配到的命名分组
+        """
+        # 每种公式都必须含 "$" 或 "\begin{"，先用子串查找快速排除普通文本，
+        # 避免在长段落上进入正则引擎（及 .*? 的回溯）
+        if '$' not in text and '\\begin{' not in text:
+            return []
+        return [(m.start(), m.end(), m.lastgroup) for m in self._formula_re.finditer(text)]
\ No newline at end of file
@@ -1,124 +1,40 @@
+import re
+import time
 from pathlib import Path
 from typing import Optional
 from .models import PageContent, TextBlock, FormulaBlock
 
+# 段落分隔（连续空行）与段内换行（连同两侧空白折叠为一个空格）
+_PARA_SPLIT = re.compile(r'\n{2,}')
+_INLINE_NL = re.compile(r'\s*\n\s*')
 
-class HTMLBuilder:
-    def __init__(self, title: str, output_path: Optional[Path] = None, streaming: bool = False):
-        """
-        初始化HTML构建器
-        
-        Args:
-            title: 文档标题
-            output_path: 输出路径（流式模式必需）
-            streaming: 是否启用流式模式（每页处理完立即写入）
-        """
-        self._title = title
-        self._pages: list[PageContent] = []
-        self._output_path = output_path
-        self._streaming = streaming
-        self._file_handle = None
-        self._header_written = False
-        self._current_page = None  # 当前正在写入的页码
 
-    def add_page(self, page: PageContent) -> None:
-        """添加页面（流式模式下会立即写入）"""
-        self._pages.append(page)
-        
-        if self._streaming and self._output_path:
-            self._write_page_streaming(page)
-    
-    def add_block(self, block, page_number: int) -> None:
-        """
-        添加单个块（块级流式模式）
-        
-        Args:
-            block: TextBlock 或 FormulaBlock
-            page_number: 页码
-        """
-        if not self._streaming or not self._output_path:
-            return
-        
-        # 确保头部已写入
-        if not self._header_written:
-            self._write_header()
-            self._header_written = True
-        
-        # 检查是否需要开始新页面
-        if not hasattr(self, '_current_page') or self._current_page != page_number:
-            # 新页面开始
-            if hasattr(self, '_current_page') and self._current_page is not None:
-                # 关闭上一个页面
-                if self._file_handle:
-                    self._file_handle.write('        </div>\n      </article>\n')
-                    self._file_handle.flush()
-            
-            # 开始新页面
-            self._current_page = page_number
-            if self._file_handle:
-                page_start = f'      <article class="page">\n        <div class="page-header">\n          <span class="page-number">Page {page_number}</span>\n        </div>\n        <div class="page-content">\n'
-                self._file_handle.write(page_start)
-                self._file_handle.flush()
-        
-        # 写入块
-        block_html = self._render_block(block)
-        if self._file_handle:
-            self._file_handle.write(block_html)
-            self._file_handle.flush()
+def _merge_text_runs(blocks: list) -> list:
+    """
+    将连续的 TextBlock 合并为一个（以空行连接），公式块作为分隔
 
-    def _write_page_streaming(self, page: PageContent) -> None:
-        """流式写入单页"""
-        if not self._header_written:
-            self._write_header()
-            self._header_written = True
-        
-        # 写入页面内容
-        page_html = self._render_page(page)
-        if self._file_handle:
-            self._file_handle.write(page_html)
-            self._file_handle.flush()  # 立即刷新到磁盘
+    渲染时空行本就拆分为独立段落，因此合并前后输出一致，
+    但 OCR 页面中逐行产生的大量小文本块只需渲染一次。
+    """
+    merged = []
+    run: list[TextBlock] = []
+    for block in blocks + [None]:
+        if type(block) is TextBlock:
+            run.append(block)
+            continue
+        if len(run) == 1:
+            merged.append(run[0])
+        elif run:
+            merged.append(TextBlock('\n\n'.join([b.content for b in run])))
+        run = []
+        if block is not None:
+            merged.append(block)
+    return merged
 
-    def _write_header(self) -> None:
-        """写入HTML头部"""
-        if not self._output_path:
-            return
-        
-        # 打开文件（追加模式）
-        self._file_handle = open(self._output_path, 'w', encoding='utf-8')
-        
-        # 写入HTML头部
-        header = self._get_html_header()
-        self._file_handle.write(header)
-        self._file_handle.flush()
 
-    def _get_html_header(self) -> str:
-        """获取HTML头部内容"""
-        html_parts = []
-        
-        html_parts.append('<!DOCTYPE html>')
-        html_parts.append('<html lang="zh-CN">')
-        html_parts.append('<head>')
-        html_parts.append('  <meta charset="UTF-8">')
-        html_parts.append('  <meta name="viewport" content="width=device-width, initial-scale=1.0">')
-        html_parts.append(f'  <title>{self._title}</title>')
-        html_parts.append('  <style>')
-        html_parts.append(self._get_css_styles())
-        html_parts.append('  </style>')
-        html_parts.append('</head>')
-        html_parts.append('<body>')
-        html_parts.append('  <div class="document-wrapper">')
-        html_parts.append('    <header class="document-header">')
-        html_parts.append(f'      <h1 class="document-title">{self._title}</h1>')
-        html_parts.append('    </header>')
-        html_parts.append('    <div class="document-content">')
-        
-        return '\n'.join(html_parts) + '\n'
-    
-    def _get_css_styles(self) -> str:
-        """获取CSS样式（从原有build方法中提取）"""
-        # 这里复用原有的CSS样式代码
-        # 为了简化，直接从原有代码中提取
-        return '''    /* Bridgewater Associates 官方设计规范 - 完全对齐 */
+class HTMLBuilder:
+    # CSS 样式为静态内容，作为类常量只构造一次
+    _CSS_STYLES = '''    /* Bridgewater Associates 官方设计规范 - 完全对齐 */
     /* 参考: https://www.bridgewater.com/research-and-insights/investing-in-a-new-world-capturing-opportunity-and-weathering-uncertainty */
     :root {
       /* 字体系统 - 优雅衬线字体 */
@@ -272,79 +188,252 @@ class HTMLBuilder:
       .page-header { border-bottom: 1px solid #ddd; }
     }'''
 
-    def _render_block(self, block) -> str:
-        """渲染单个块为HTML"""
-        if isinstance(block, TextBlock):
-            text = block.content.strip()
-            if text:
-                # 转义HTML
-                text = self._escape_html(text)
-                return f'          <p>{text}</p>\n'
-        elif isinstance(block, FormulaBlock):
-            formula = block.content.strip()
-            if formula:
-                formula = self._escape_html(formula)
-                return f'          <div class="formula">\n            <math xmlns="http://www.w3.org/1998/Math/MathML">{formula}</math>\n          </div>\n'
-        return ''
+    # 页面骨架模板：所有页面结构相同，只需填入页码与正文
+    _PAGE_OPEN = (
+        '      <article class="page">\n'
+        '        <div class="page-header">\n'
+        '          <span class="page-number">Page %d</span>\n'
+        '        </div>\n'
+        '        <div class="page-content">\n'
+    )
+    _PAGE_CLOSE = '        </div>\n      </article>\n'
+    _PAGE_TMPL = _PAGE_OPEN + '%s' + _PAGE_CLOSE
+
+    # 块级 HTML 模板，用 % 填充（单个 %s 替换）
+    _P_TMPL = '          <p>%s</p>\n'
+    _FORMULA_TMPL = (
+        '          <div class="formula">\n'
+        '            <math xmlns="http://www.w3.org/1998/Math/MathML">%s</math>\n'
+        '          </div>\n'
+    )
+    _EMPTY_PAGE_HTML = '          <p style="color: var(--color-text-muted); font-style: italic;">（此页无内容）</p>\n'
+
+    # HTML 转义表，translate 单次扫描完成全部替换
+    _ESCAPE_TABLE = str.maketrans({
+        '&': '&amp;',
+        '<': '&lt;',
+        '>': '&gt;',
+        '"': '&quot;',
+        "'": '&#39;',
+    })
+
+    def __init__(
+        self,
+        title: str,
+        output_path: Optional[Path] = None,
+        streaming: bool = False,
+        flush_every_n_pages: int = 0,
+        block_flush_interval: float = 0.0,
+    ):
+        """
+        初始化HTML构建器
+        
+        Args:
+            title: 文档标题
+            output_path: 输出路径（流式模式必需）
+            streaming: 是否启用流式模式（每页处理完立即写入）
+            flush_every_n_pages: 流式模式下每写完 N 页刷新一次到磁盘（便于实时预览），
+                0 表示只在 build() 时刷新
+            block_flush_interval: 块级流式（add_block）下两次刷新之间的最小间隔（秒），
+                页面尚未写完时也能看到已识别的段落；0 表示不按块刷新
+        """
+        self._title = title
+        self._pages: list[PageContent] = []
+        self._output_path = output_path
+        self._streaming = streaming
+        self._file_handle = None
+        self._header_written = False
+        self._current_page = None  # 当前正在写入的页码
+        self._flush_every_n_pages = flush_every_n_pages
+        self._pages_since_flush = 0
+        self._block_flush_interval = block_flush_interval
+        self._last_flush_ts = 0.0
+
+    def add_page(self, page: PageContent) -> None:
+        """添加页面（流式模式下会立即写入）"""
+        self._pages.append(page)
+        
+        if self._streaming and self._output_path:
+            self._write_page_streaming(page)
     
-    def _render_page(self, page: PageContent) -> str:
-        """渲染单页为HTML"""
-        html_parts = []
+    def add_block(self, block, page_number: int) -> None:
+        """
+        添加单个块（块级流式模式）
         
-        html_parts.append('      <article class="page">')
-        html_parts.append('        <div class="page-header">')
-        html_parts.append(f'          <span class="page-number">Page {page.page_number}</span>')
-        html_parts.append('        </div>')
-        html_parts.append('        <div class="page-content">')
+        Args:
+            block: TextBlock 或 FormulaBlock
+            page_number: 页码
+        """
+        if not self._streaming or not self._output_path:
+            return
         
-        body_parts = []
-        for block in page.blocks:
-            if isinstance(block, TextBlock):
-                text = block.content.strip()
-                if text:
-                    # 将换行符转换为段落
-                    paragraphs = text.split('\n\n')
-                    for para in paragraphs:
-                        para = para.strip()
-                        if para:
-                            # 处理单行换行，转换为空格
-                            para = ' '.join(para.split('\n'))
-                            body_parts.append(f'          <p>{self._escape_html(para)}</p>')
+        # 确保头部已写入
+        if not self._header_written:
+            self._write_header()
+            self._header_written = True
+        
+        # 本次要写入的片段，合并后一次 write
+        parts: list[str] = []
+        
+        # 检查是否需要开始新页面
+        page_closed = False
+        if self._current_page != page_number:
+            # 新页面开始
+            if self._current_page is not None:
+                # 关闭上一个页面
+                parts.append(self._PAGE_CLOSE)
+                page_closed = True
             
-            elif isinstance(block, FormulaBlock):
-                formula = block.content.strip()
-                if formula:
-                    body_parts.append('          <div class="formula">')
-                    body_parts.append(f'            <math xmlns="http://www.w3.org/1998/Math/MathML">{self._escape_html(formula)}</math>')
-                    body_parts.append('          </div>')
+            # 开始新页面
+            self._current_page = page_number
+            parts.append(self._PAGE_OPEN % page_number)
+        
+        # 写入块：与整页写入使用同一套渲染函数，按块或按页写出的 HTML 一致
+        handler = self._RENDERERS.get(type(block))
+        if handler:
+            parts.extend(handler(self, block))
+        if self._file_handle:
+            self._file_handle.write(''.join(parts).encode('utf-8'))
+            if page_closed:
+                # 上一页写完：与整页写入相同，按 flush_every_n_pages 刷新
+                self._on_page_written()
+            if (
+                self._block_flush_interval > 0
+                and time.monotonic() - self._last_flush_ts >= self._block_flush_interval
+            ):
+                # 页内按时间节流刷新，而不是每块一次
+                self._flush()
+
+    def _write_page_streaming(self, page: PageContent) -> None:
+        """流式写入单页"""
+        if not self._header_written:
+            self._write_header()
+            self._header_written = True
+        
+        # 写入页面内容
+        if self._file_handle:
+            self._stream_page(page, self._file_handle)
+            self._on_page_written()
+
+    def _stream_page(self, page: PageContent, fh) -> None:
+        """
+        将单页逐片段直接写入文件，不构造整页字符串
+
+        Args:
+            page: 页面内容
+            fh: 以二进制模式打开的缓冲文件对象，由其合并小块写入
+        """
+        write = fh.write
+        write((self._PAGE_OPEN % page.page_number).encode('utf-8'))
+        
+        wrote_body = False
+        renderers = self._RENDERERS
+        for block in _merge_text_runs(page.blocks):
+            handler = renderers.get(type(block))
+            if handler:
+                for fragment in handler(self, block):
+                    write(fragment.encode('utf-8'))
+                    wrote_body = True
         
         # 如果页面为空，添加占位符
-        if not body_parts:
-            body_parts.append('          <p style="color: var(--color-text-muted); font-style: italic;">（此页无内容）</p>')
+        if not wrote_body:
+            write(self._EMPTY_PAGE_HTML.encode('utf-8'))
+        
+        write(self._PAGE_CLOSE.encode('utf-8'))
+
+    def _on_page_written(self) -> None:
+        """页面写完后按 flush_every_n_pages 决定是否刷新到磁盘"""
+        if self._flush_every_n_pages <= 0:
+            return
+        self._pages_since_flush += 1
+        if self._pages_since_flush >= self._flush_every_n_pages:
+            self._flush()
+
+    def _flush(self) -> None:
+        """把缓冲区写到磁盘，并重置按页、按时间的刷新计数"""
+        self._file_handle.flush()
+        self._pages_since_flush = 0
+        self._last_flush_ts = time.monotonic()
+
+    def _write_header(self) -> None:
+        """写入HTML头部"""
+        if not self._output_path:
+            return
         
-        html_parts.extend(body_parts)
-        html_parts.append('        </div>')
-        html_parts.append('      </article>')
+        # 以二进制模式打开，使用较大的缓冲区，由缓冲区合并小块写入；
+        # 各片段在写入前自行编码为 UTF-8，省去 TextIOWrapper 一层
+        self._file_handle = open(self._output_path, 'wb', buffering=1024 * 1024)
         
-        return '\n'.join(html_parts) + '\n'
+        # 写入HTML头部
+        header = self._get_html_header()
+        self._file_handle.write(header.encode('utf-8'))
+
+    def _get_html_header(self) -> str:
+        """获取HTML头部内容"""
+        return (
+            '<!DOCTYPE html>\n<html lang="zh-CN">\n<head>\n'
+            '  <meta charset="UTF-8">\n'
+            '  <meta name="viewport" content="width=device-width, initial-scale=1.0">\n'
+            f'  <title>{self._title}</title>\n'
+            '  <style>\n' + self._CSS_STYLES + '\n  </style>\n'
+            '</head>\n<body>\n  <div class="document-wrapper">\n'
+            '    <header class="document-header">\n'
+            f'      <h1 class="document-title">{self._title}</h1>\n'
+            '    </header>\n    <div class="document-content">\n'
+        )
+    
+    def _render_text_block(self, block: TextBlock) -> list[str]:
+        """渲染文本块，按空行拆分为多个段落（内容在构造时已去除首尾空白）"""
+        text = block.content
+        if not text:
+            return []
+        parts = []
+        # 将换行符转换为段落，段内换行转换为空格
+        for para in _PARA_SPLIT.split(text):
+            para = _INLINE_NL.sub(' ', para).strip()
+            if para:
+                parts.append(self._P_TMPL % self._escape_html(para))
+        return parts
+
+    def _render_formula_block(self, block: FormulaBlock) -> list[str]:
+        """渲染公式块"""
+        formula = block.content
+        if not formula:
+            return []
+        return [self._FORMULA_TMPL % self._escape_html(formula)]
+
+    # 按块的精确类型分发渲染函数，避免逐块 isinstance 判断
+    _RENDERERS = {
+        TextBlock: _render_text_block,
+        FormulaBlock: _render_formula_block,
+    }
+
+    def _render_page(self, page: PageContent) -> str:
+        """渲染单页为HTML"""
+        body_parts = []
+        renderers = self._RENDERERS
+        for block in _merge_text_runs(page.blocks):
+            handler = renderers.get(type(block))
+            if handler:
+                body_parts.extend(handler(self, block))
+        
+        # 如果页面为空，添加占位符
+        if not body_parts:
+            body_parts.append(self._EMPTY_PAGE_HTML)
+        
+        return self._PAGE_TMPL % (page.page_number, ''.join(body_parts))
 
     def _escape_html(self, text: str) -> str:
         """转义HTML特殊字符"""
-        return (text
-                .replace('&', '&amp;')
-                .replace('<', '&lt;')
-                .replace('>', '&gt;')
-                .replace('"', '&quot;')
-                .replace("'", '&#39;'))
+        return text.translate(self._ESCAPE_TABLE)
 
     def build(self, output_path: Optional[Path] = None) -> None:
         """构建HTML文件（非流式模式）"""
         if self._streaming:
             # 流式模式下，关闭当前页面（如果有）并写入尾部
-            if hasattr(self, '_current_page') and self._current_page is not None:
+            if self._current_page is not None:
                 if self._file_handle:
-                    self._file_handle.write('        </div>\n      </article>\n')
-                    self._file_handle.flush()
+                    self._file_handle.write(self._PAGE_CLOSE.encode('utf-8'))
             
             self._write_footer()
             if self._file_handle:
@@ -365,43 +454,17 @@ class HTMLBuilder:
                 blocks=[TextBlock(content="（无内容）")]
             ))
         
-        html_parts = []
-        
-        # HTML 头部
-        html_parts.append('<!DOCTYPE html>')
-        html_parts.append('<html lang="zh-CN">')
-        html_parts.append('<head>')
-        html_parts.append('  <meta charset="UTF-8">')
-        html_parts.append('  <meta name="viewport" content="width=device-width, initial-scale=1.0">')
-        html_parts.append(f'  <title>{self._title}</title>')
-        html_parts.append('  <style>')
-        html_parts.append(self._get_css_styles())
-        html_parts.append('  </style>')
-        html_parts.append('</head>')
-        html_parts.append('<body>')
-        html_parts.append('  <div class="document-wrapper">')
-        html_parts.append('    <header class="document-header">')
-        html_parts.append(f'      <h1 class="document-title">{self._title}</h1>')
-        html_parts.append('    </header>')
-        html_parts.append('    <div class="document-content">')
-        
-        # 添加所有页面
-        for page in self._pages:
-            html_parts.append(self._render_page(page))
-        
-        # HTML 尾部
-        html_parts.append('    </div>')
-        html_parts.append('  </div>')
-        html_parts.append('</body>')
-        html_parts.append('</html>')
-        
-        # 写入文件
-        html_content = '\n'.join(html_parts)
+        # 头部 + 所有页面 + 尾部，一次拼接
+        html_content = (
+            self._get_html_header()
+            + ''.join([self._render_page(page) + '\n' for page in self._pages])
+            + '    </div>\n  </div>\n</body>\n</html>'
+        )
         output_path.write_text(html_content, encoding='utf-8')
     
     def _write_footer(self) -> None:
         """写入HTML尾部"""
         if self._file_handle:
-            footer = '    </div>\n  </div>\n</body>\n</html>\n'
+            footer = b'    </div>\n  </div>\n</body>\n</html>\n'
             self._file_handle.write(footer)
             self._file_handle.flush()
@@ -4,7 +4,7 @@ Image splitter for PDF pages.
 Split page image into paragraph-level regions.
 """
 
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from PIL import Image
 import numpy as np
 
@@ -14,6 +14,86 @@ except ImportError:
     HAS_IMAGE_LIBS = False
     np = None
 
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+
+def _group_paragraphs_numpy(y_min, y_max, x_min, x_max, gap_threshold):
+    """
+    Group sorted OCR lines into paragraphs with NumPy boolean masks.
+
+    Returns:
+        (starts, ends): index of the first and last line of each paragraph
+    """
+    # pairwise (line i, line i+1) paragraph decision, all at once
+    vertical_gap = y_min[1:] - y_max[:-1]
+    indent_diff = np.abs(x_min[1:] - x_min[:-1])
+    overlap_width = np.minimum(x_max[1:], x_max[:-1]) - np.maximum(
+        x_min[1:], x_min[:-1]
+    )
+    union_width = np.maximum(x_max[1:], x_max[:-1]) - np.minimum(
+        x_min[1:], x_min[:-1]
+    )
+    overlap_ratio = np.divide(
+        overlap_width,
+        union_width,
+        out=np.zeros_like(overlap_width),
+        where=union_width > 0,
+    )
+
+    same_paragraph = (
+        (vertical_gap < gap_threshold)
+        & (indent_diff < 40)
+        & (overlap_ratio > 0.6)
+    )
+
+    # a new paragraph starts at every line not joined to its predecessor
+    breaks = np.flatnonzero(~same_paragraph) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks - 1, [len(y_min) - 1]))
+    return starts, ends
+
+
+def _group_paragraphs_loop(y_min, y_max, x_min, x_max, gap_threshold):
+    """
+    Same grouping as _group_paragraphs_numpy as a single sweep,
+    written for Numba (no temporaries besides the result arrays).
+    """
+    n = y_min.shape[0]
+    starts = np.empty(n, np.int64)
+    ends = np.empty(n, np.int64)
+    k = 0
+    starts[0] = 0
+
+    for i in range(n - 1):
+        vertical_gap = y_min[i + 1] - y_max[i]
+        indent_diff = abs(x_min[i + 1] - x_min[i])
+        overlap_width = min(x_max[i], x_max[i + 1]) - max(x_min[i], x_min[i + 1])
+        union_width = max(x_max[i], x_max[i + 1]) - min(x_min[i], x_min[i + 1])
+        overlap_ratio = overlap_width / union_width if union_width > 0 else 0.0
+
+        if not (
+            vertical_gap < gap_threshold
+            and indent_diff < 40
+            and overlap_ratio > 0.6
+        ):
+            ends[k] = i
+            k += 1
+            starts[k] = i + 1
+
+    ends[k] = n - 1
+    return starts[:k + 1], ends[:k + 1]
+
+
+# JIT the sweep when Numba is available, otherwise fall back to NumPy masks
+if HAS_NUMBA:
+    _group_paragraphs = njit(cache=True)(_group_paragraphs_loop)
+else:
+    _group_paragraphs = _group_paragraphs_numpy
+
 
 class ImageSplitter:
     """
@@ -34,6 +114,29 @@ class ImageSplitter:
         Returns:
             List of (paragraph_image, y_start, y_end)
         """
+        return [
+            (para_img, y_start, y_end)
+            for para_img, y_start, y_end, _ in self.split_into_paragraphs(image, ocr_engine)
+        ]
+
+    def split_into_paragraphs(
+        self,
+        image: Image.Image,
+        ocr_engine=None
+    ) -> List[Tuple[Image.Image, int, int, Optional[list]]]:
+        """
+        Split page into paragraph regions, keeping the OCR lines found while splitting.
+
+        Splitting already runs detection + recognition on the whole page, so
+        each paragraph carries the recognized lines that fall inside it and
+        callers do not need to run the model on the crops again.
+
+        Returns:
+            List of (paragraph_image, y_start, y_end, lines), where lines is a
+            list of (text, confidence, (x1, y1, x2, y2)) relative to the
+            paragraph image, top to bottom; lines is None when the page was
+            not OCR'd here (no engine or the split failed)
+        """
         if not HAS_IMAGE_LIBS:
             return []
 
@@ -44,105 +147,104 @@ class ImageSplitter:
                 print(f"OCR paragraph split failed: {e}")
 
         # fallback
-        return [(image, 0, image.size[1])]
+        return [(image, 0, image.size[1], None)]
 
     # --------------------------------------------------
     # Core paragraph algorithm
     # --------------------------------------------------
 
+    @staticmethod
+    def _line_text(item) -> Tuple[str, float]:
+        """(text, confidence) of one PaddleOCR result item."""
+        try:
+            text = item[1][0] if isinstance(item[1][0], str) else str(item[1][0])
+            return text, float(item[1][1])
+        except (IndexError, TypeError, ValueError):
+            return "", 0.0
+
     def _split_by_ocr_paragraph(
         self,
         image: Image.Image,
         ocr_engine
-    ) -> List[Tuple[Image.Image, int, int]]:
+    ) -> List[Tuple[Image.Image, int, int, list]]:
         """
         Paragraph-aware OCR splitting.
         """
-        img_array = np.array(image.convert("RGB"))
-        ocr_result = ocr_engine._ocr.ocr(img_array)
+        # PaddleOCR expects a 3-channel ndarray; only convert when needed
+        # and let asarray reuse PIL's buffer instead of copying it again
+        rgb = image if image.mode == "RGB" else image.convert("RGB")
+        img_array = np.asarray(rgb)
+        ocr_result = ocr_engine.ocr_page(img_array)
 
         if not ocr_result or not ocr_result[0]:
-            return [(image, 0, image.size[1])]
-
-        lines = []
-        for item in ocr_result[0]:
-            bbox = item[0]
-            if not bbox:
-                continue
-
-            xs = [p[0] for p in bbox]
-            ys = [p[1] for p in bbox]
-
-            lines.append(
-                {
-                    "y_min": min(ys),
-                    "y_max": max(ys),
-                    "x_min": min(xs),
-                    "x_max": max(xs),
-                    "height": max(ys) - min(ys),
-                }
-            )
-
-        if len(lines) <= 1:
-            return [(image, 0, image.size[1])]
-
-        # sort by vertical position
-        lines.sort(key=lambda x: x["y_min"])
+            return [(image, 0, image.size[1], [])]
+
+        # collect all 4-point bboxes into one (N, 4, 2) array
+        items = [item for item in ocr_result[0] if item[0]]
+        if not items:
+            return [(image, 0, image.size[1], [])]
+
+        bboxes = np.asarray([item[0] for item in items], dtype=np.float64)
+        xs = bboxes[..., 0]
+        ys = bboxes[..., 1]
+        x_min = xs.min(axis=1)
+        x_max = xs.max(axis=1)
+        y_min = ys.min(axis=1)
+        y_max = ys.max(axis=1)
+
+        # sort by vertical position (parallel arrays, one per field)
+        order = np.argsort(y_min, kind="stable")
+        y_min = y_min[order]
+        y_max = y_max[order]
+        x_min = x_min[order]
+        x_max = x_max[order]
+        line_texts = [self._line_text(items[i]) for i in order.tolist()]
+
+        if len(items) == 1:
+            # a single line: the whole page is one paragraph
+            return [(image, 0, image.size[1], self._paragraph_lines(
+                line_texts, x_min, y_min, x_max, y_max, 0, 0, 0
+            ))]
 
         # compute median line gap
-        gaps = [
-            lines[i + 1]["y_min"] - lines[i]["y_max"]
-            for i in range(len(lines) - 1)
-        ]
-        median_gap = np.median([g for g in gaps if g > 0]) if gaps else 0
-
-        paragraphs: List[Tuple[int, int]] = []
-
-        cur_start = lines[0]["y_min"]
-        cur_end = lines[0]["y_max"]
-
-        for i in range(len(lines) - 1):
-            l1 = lines[i]
-            l2 = lines[i + 1]
-
-            vertical_gap = l2["y_min"] - l1["y_max"]
-            indent_diff = abs(l2["x_min"] - l1["x_min"])
+        gaps = y_min[1:] - y_max[:-1]
+        positive_gaps = gaps[gaps > 0]
+        median_gap = float(np.median(positive_gaps)) if positive_gaps.size else 0.0
 
-            overlap_width = min(l1["x_max"], l2["x_max"]) - max(
-                l1["x_min"], l2["x_min"]
-            )
-            union_width = max(l1["x_max"], l2["x_max"]) - min(
-                l1["x_min"], l2["x_min"]
-            )
-            overlap_ratio = (
-                overlap_width / union_width if union_width > 0 else 0
-            )
-
-            same_paragraph = (
-                vertical_gap < max(1.5 * median_gap, 8)
-                and indent_diff < 40
-                and overlap_ratio > 0.6
-            )
-
-            if same_paragraph:
-                cur_end = l2["y_max"]
-            else:
-                paragraphs.append((cur_start, cur_end))
-                cur_start = l2["y_min"]
-                cur_end = l2["y_max"]
-
-        paragraphs.append((cur_start, cur_end))
+        starts, ends = _group_paragraphs(
+            y_min, y_max, x_min, x_max, max(1.5 * median_gap, 8)
+        )
 
         # crop paragraph images
+        # Image.crop copies eagerly and every crop stays alive in the
+        # returned list (callers may save it), so crops cannot share
+        # one scratch buffer; each one owns its own pixels.
         width, height = image.size
         results = []
 
-        for y_start, y_end in paragraphs:
+        for first, last, y_start, y_end in zip(
+            starts.tolist(), ends.tolist(), y_min[starts].tolist(), y_max[ends].tolist()
+        ):
             y0 = max(0, int(y_start) - 5)
             y1 = min(height, int(y_end) + 5)
 
             if y1 - y0 > 20:
                 para_img = image.crop((0, y0, width, y1))
-                results.append((para_img, y0, y1))
-
-        return results
\ No newline at end of file
+                lines = self._paragraph_lines(
+                    line_texts, x_min, y_min, x_max, y_max, first, last, y0
+                )
+                results.append((para_img, y0, y1, lines))
+
+        return results
+
+    @staticmethod
+    def _paragraph_lines(line_texts, x_min, y_min, x_max, y_max, first, last, top) -> list:
+        """Lines first..last (sorted order) with bboxes shifted to the paragraph crop."""
+        return [
+            (
+                line_texts[i][0],
+                line_texts[i][1],
+                (int(x_min[i]), int(y_min[i]) - top, int(x_max[i]), int(y_max[i]) - top),
+            )
+            for i in range(first, last + 1)
+        ]
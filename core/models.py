@@ -1,20 +1,27 @@
 # core/models.py
 from dataclasses import dataclass
-from typing import List
+from typing import List, Union
 
 
-@dataclass
+@dataclass(slots=True)
 class FormulaBlock:
     content: str           # LaTeX or MathML
     inline: bool = False
 
+    def __post_init__(self):
+        # 构造时统一去除首尾空白，下游无需重复 strip()
+        self.content = self.content.strip()
 
-@dataclass
+
+@dataclass(slots=True)
 class TextBlock:
     content: str
 
+    def __post_init__(self):
+        self.content = self.content.strip()
+
 
-@dataclass
+@dataclass(slots=True)
 class PageContent:
     page_number: int
-    blocks: List[object]   # TextBlock | FormulaBlock
\ No newline at end of file
+    blocks: List[Union[TextBlock, FormulaBlock]]
\ No newline at end of file
@@ -3,6 +3,8 @@
 OCR引擎 - 支持数学公式识别
 支持多种OCR后端：PaddleOCR（推荐）、EasyOCR、Tesseract
 """
+import logging
+import threading
 from pathlib import Path
 from typing import List, Tuple, Optional
 
@@ -15,19 +17,61 @@ except ImportError:
     np = None
 
 
+logger = logging.getLogger(__name__)
+
+# 公式检测用的数学符号（单字符，用集合判断是否出现）
+_MATH_INDICATORS = frozenset('=∑∫√≤≥≠±×÷αβγπθλμσ∞∂')
+
+
+def _paddleocr_major_version() -> int:
+    """已安装的 PaddleOCR 主版本号（无法解析时返回 0）"""
+    import paddleocr
+    try:
+        return int(str(getattr(paddleocr, "__version__", "0")).split(".")[0])
+    except ValueError:
+        return 0
+
+
 class OCREngine:
     """OCR引擎，支持文本和数学公式识别"""
     
-    def __init__(self, backend: str = "paddleocr"):
+    def __init__(
+        self,
+        backend: str = "paddleocr",
+        lang: str = "ch",
+        use_angle_cls: bool = True,
+        hpi: bool = False,
+        precision: Optional[str] = None,
+    ):
         """
         初始化OCR引擎
         
         Args:
             backend: OCR后端，可选 "paddleocr", "easyocr", "tesseract"
+            lang: PaddleOCR 识别语言
+            use_angle_cls: PaddleOCR 是否启用方向分类
+            hpi: PaddleOCR 3.x 是否启用高性能推理（自动选择 ONNX Runtime / OpenVINO / TensorRT 后端），
+                默认关闭；PaddleOCR 2.x 不支持，忽略
+            precision: 高性能推理的计算精度，如 "fp16"、"fp32"；None 使用 PaddleOCR 默认值。
+                fp16 会改变 CPU 推理结果，需要时显式指定
         """
         self._backend = backend.lower()
+        self._lang = lang
+        self._use_angle_cls = use_angle_cls
+        self._hpi = hpi
+        self._precision = precision
         self._ocr = None
         self._initialized = False
+        # 初始化失败的引擎不标记为已初始化；get_ocr_engine 发现后会换一个新实例重试
+        self._failed = False
+        self._init_lock = threading.Lock()
+        # 模型实例不是线程安全的：同一引擎被多个会话/预热线程共享时，推理逐个进行
+        self._infer_lock = threading.Lock()
+
+    @property
+    def failed(self) -> bool:
+        """初始化是否失败（失败的实例不会再重试，由 get_ocr_engine 替换）"""
+        return self._failed
         
     def _initialize(self, progress_callback=None):
         """
@@ -36,75 +80,125 @@ class OCREngine:
         Args:
             progress_callback: 可选的进度回调函数，用于显示初始化进度
         """
-        if self._initialized:
+        if self._initialized or self._failed:
             return
+        
+        # 加锁，避免后台预热线程与调用线程重复加载模型
+        with self._init_lock:
+            if self._initialized or self._failed:
+                return
             
-        try:
-            if self._backend == "paddleocr":
-                from paddleocr import PaddleOCR
-                
-                # 显示初始化提示
-                if progress_callback:
-                    progress_callback.update("正在初始化 PaddleOCR 引擎（首次使用可能需要几分钟）...")
-                else:
-                    print("正在初始化 PaddleOCR 引擎（首次使用可能需要几分钟）...")
+            try:
+                if self._backend == "paddleocr":
+                    from paddleocr import PaddleOCR
                 
-                # 初始化PaddleOCR，支持中英文和数学公式
-                # PaddleOCR 3.x 不再支持 use_gpu 参数，默认使用 CPU
-                # 如果需要 GPU，可以通过环境变量或 device 参数控制
-                # 注意：初始化过程会加载多个模型，可能需要一些时间
-                self._ocr = PaddleOCR(
-                    use_angle_cls=True,
-                    lang='ch',  # 中英文混合
-                    # 注意：PaddleOCR 3.x 移除了 use_gpu 参数
-                    # 默认使用 CPU，如需 GPU 请参考官方文档配置
-                )
+                    # 显示初始化提示
+                    if progress_callback:
+                        progress_callback.update("正在初始化 PaddleOCR 引擎（首次使用可能需要几分钟）...")
+                    else:
+                        print("正在初始化 PaddleOCR 引擎（首次使用可能需要几分钟）...")
                 
-                if progress_callback:
-                    progress_callback.update("PaddleOCR 引擎初始化完成")
-                else:
-                    print("PaddleOCR 引擎初始化完成")
-            elif self._backend == "easyocr":
-                if progress_callback:
-                    progress_callback.update("正在初始化 EasyOCR 引擎（首次使用可能需要几分钟）...")
-                else:
-                    print("正在初始化 EasyOCR 引擎（首次使用可能需要几分钟）...")
-                import easyocr
-                self._ocr = easyocr.Reader(['ch_sim', 'en'], gpu=False)
-                if progress_callback:
-                    progress_callback.update("EasyOCR 引擎初始化完成")
-                else:
-                    print("EasyOCR 引擎初始化完成")
-            elif self._backend == "tesseract":
-                import pytesseract
-                self._ocr = pytesseract
-            else:
-                raise ValueError(f"不支持的OCR后端: {self._backend}")
+                    # 初始化PaddleOCR，支持中英文和数学公式
+                    # PaddleOCR 3.x 不再支持 use_gpu 参数，默认使用 CPU
+                    # 如果需要 GPU，可以通过环境变量或 device 参数控制
+                    # 注意：初始化过程会加载多个模型，可能需要一些时间
+                    paddle_kwargs = dict(
+                        use_angle_cls=self._use_angle_cls,
+                        lang=self._lang,  # 默认 'ch'：中英文混合
+                        # 注意：PaddleOCR 3.x 移除了 use_gpu 参数
+                        # 默认使用 CPU，如需 GPU 请参考官方文档配置
+                    )
+                    self._ocr = None
+                    if self._hpi and _paddleocr_major_version() < 3:
+                        # 2.x 会静默接受未知参数而不报错，只能按版本判断
+                        logger.warning("PaddleOCR 2.x 不支持高性能推理，忽略 hpi/precision 参数")
+                    elif self._hpi:
+                        # PaddleOCR 3.x 高性能推理；缺少高性能推理插件时回退到默认推理后端
+                        hpi_kwargs = dict(enable_hpi=True)
+                        if self._precision is not None:
+                            hpi_kwargs["precision"] = self._precision
+                        try:
+                            self._ocr = PaddleOCR(**paddle_kwargs, **hpi_kwargs)
+                        except Exception as e:
+                            logger.warning("PaddleOCR 高性能推理不可用，使用默认推理后端: %s", e)
+                    if self._ocr is None:
+                        self._ocr = PaddleOCR(**paddle_kwargs)
                 
-            self._initialized = True
-        except ImportError as e:
-            error_msg = str(e)
-            if "paddle" in error_msg.lower():
-                print(f"Warning: PaddleOCR 依赖未完整安装: {error_msg}")
-                print("请安装完整依赖:")
-                print("  pip install paddlepaddle")
-                print("  pip install paddleocr")
-            else:
-                print(f"Warning: OCR库未安装，将使用基础文本提取: {error_msg}")
-                if self._backend == "paddleocr":
-                    print("请安装: pip install paddlepaddle paddleocr")
+                    if progress_callback:
+                        progress_callback.update("PaddleOCR 引擎初始化完成")
+                    else:
+                        print("PaddleOCR 引擎初始化完成")
                 elif self._backend == "easyocr":
-                    print("请安装: pip install easyocr")
+                    if progress_callback:
+                        progress_callback.update("正在初始化 EasyOCR 引擎（首次使用可能需要几分钟）...")
+                    else:
+                        print("正在初始化 EasyOCR 引擎（首次使用可能需要几分钟）...")
+                    import easyocr
+                    self._ocr = easyocr.Reader(['ch_sim', 'en'], gpu=False)
+                    if progress_callback:
+                        progress_callback.update("EasyOCR 引擎初始化完成")
+                    else:
+                        print("EasyOCR 引擎初始化完成")
                 elif self._backend == "tesseract":
-                    print("请安装: pip install pytesseract")
-                    print("还需要安装系统依赖: brew install tesseract (macOS)")
-            self._ocr = None
-            self._initialized = True
+                    import pytesseract
+                    self._ocr = pytesseract
+                else:
+                    raise ValueError(f"不支持的OCR后端: {self._backend}")
+                
+                self._initialized = True
+            except ImportError as e:
+                error_msg = str(e)
+                if "paddle" in error_msg.lower():
+                    print(f"Warning: PaddleOCR 依赖未完整安装: {error_msg}")
+                    print("请安装完整依赖:")
+                    print("  pip install paddlepaddle")
+                    print("  pip install paddleocr")
+                else:
+                    print(f"Warning: OCR库未安装，将使用基础文本提取: {error_msg}")
+                    if self._backend == "paddleocr":
+                        print("请安装: pip install paddlepaddle paddleocr")
+                    elif self._backend == "easyocr":
+                        print("请安装: pip install easyocr")
+                    elif self._backend == "tesseract":
+                        print("请安装: pip install pytesseract")
+                        print("还需要安装系统依赖: brew install tesseract (macOS)")
+                self._ocr = None
+                self._failed = True
+            except Exception as e:
+                print(f"Warning: OCR引擎初始化失败: {e}")
+                print("将使用基础文本提取模式")
+                self._ocr = None
+                self._failed = True
+    
+    def ocr_page(self, image_array):
+        """
+        用 PaddleOCR 对整张图像做检测+识别，返回原始结果（持有推理锁）
+        
+        Args:
+            image_array: RGB numpy 数组
+        """
+        with self._infer_lock:
+            return self._ocr.ocr(image_array)
+    
+    def warmup(self) -> None:
+        """
+        预热OCR引擎：加载模型，并用一张空白小图跑一次推理，
+        使推理库在处理第一页之前完成内核选择等一次性开销
+        """
+        self._initialize()
+        
+        if self._ocr is None or not HAS_IMAGE_LIBS:
+            return
+        
+        dummy = np.zeros((64, 64, 3), dtype=np.uint8)
+        try:
+            if self._backend == "paddleocr":
+                self.ocr_page(dummy)
+            elif self._backend == "easyocr":
+                with self._infer_lock:
+                    self._ocr.readtext(dummy)
         except Exception as e:
-            print(f"Warning: OCR引擎初始化失败: {e}")
-            print("将使用基础文本提取模式")
-            self._ocr = None
-            self._initialized = True
+            print(f"Warning: OCR引擎预热失败: {e}")
     
     def extract_text_from_image(self, image, progress_callback=None, stream_callback=None) -> List[Tuple[str, float]]:
         """
@@ -126,35 +220,28 @@ class OCREngine:
         try:
             # 确保图像是numpy数组
             if hasattr(image, 'size'):  # PIL Image
-                image_array = np.array(image.convert('RGB'))
-                if progress_callback:
-                    progress_callback.update(f"OCR: 图片尺寸 {image.size}, 数组形状 {image_array.shape}")
+                image_array = self.to_rgb_array(image)
+                logger.debug("OCR: 图片尺寸 %s, 数组形状 %s", image.size, image_array.shape)
             else:
                 image_array = image
             
             if self._backend == "paddleocr":
                 # PaddleOCR返回格式: [[[坐标], (文本, 置信度)], ...]
                 # PaddleOCR 3.x 不再支持 cls 参数，角度分类在初始化时通过 use_angle_cls 控制
-                if progress_callback:
-                    progress_callback.update("OCR: 开始调用PaddleOCR识别...")
-                
-                result = self._ocr.ocr(image_array)
-                
-                if progress_callback:
-                    if result is None:
-                        progress_callback.update("OCR: PaddleOCR返回None")
-                    elif not result:
-                        progress_callback.update("OCR: PaddleOCR返回空列表")
-                    elif not result[0]:
-                        progress_callback.update("OCR: PaddleOCR返回空结果列表")
-                    else:
-                        progress_callback.update(f"OCR: PaddleOCR返回 {len(result[0])} 个结果")
+                result = self.ocr_page(image_array)
+                logger.debug(
+                    "OCR: PaddleOCR返回 %d 个结果",
+                    len(result[0]) if result and result[0] else 0,
+                )
                 
                 if result and result[0]:
                     results = []
                     # 按Y坐标排序（从上到下）
                     items_with_y = []
-                    for item in result[0]:
+                    y_positions = []
+                    # 一次性计算所有识别框的外接矩形
+                    extents = self._bbox_extents(result[0])
+                    for i, item in enumerate(result[0]):
                         try:
                             # 检查数据结构：item 应该是 [[坐标], (文本, 置信度)]
                             if len(item) >= 2 and isinstance(item[1], (tuple, list)) and len(item[1]) >= 2:
@@ -164,39 +251,37 @@ class OCREngine:
                                 # 计算Y坐标（使用边界框的中心或顶部）
                                 bbox = item[0] if len(item) > 0 else None
                                 y_pos = 0
-                                if bbox and isinstance(bbox, (list, tuple)) and len(bbox) > 0:
+                                if extents is not None:
+                                    y_pos = float(extents[i, 1])  # 使用顶部Y坐标
+                                elif bbox and isinstance(bbox, (list, tuple)) and len(bbox) > 0:
                                     try:
                                         y_coords = [point[1] for point in bbox if len(point) >= 2]
                                         y_pos = min(y_coords) if y_coords else 0  # 使用顶部Y坐标
                                     except:
                                         pass
                                 
-                                items_with_y.append((text, conf, y_pos))
+                                items_with_y.append((text, conf))
+                                y_positions.append(y_pos)
                                 
                                 # 流式回调：每识别到一个块就立即返回
                                 if stream_callback:
                                     stream_callback(text, conf, y_pos)
                         except (IndexError, TypeError, ValueError) as e:
-                            if progress_callback:
-                                progress_callback.update(f"OCR: PaddleOCR结果解析错误: {e}")
                             print(f"PaddleOCR结果解析错误: {e}, item: {item}")
                             continue
                     
-                    # 按Y坐标排序
-                    items_with_y.sort(key=lambda x: x[2])
-                    results = [(text, conf) for text, conf, _ in items_with_y]
-                    
-                    if progress_callback:
-                        progress_callback.update(f"OCR: 成功解析 {len(results)} 个文本块")
+                    # 按Y坐标排序（稳定排序，同一行保持识别顺序）
+                    order = np.argsort(np.asarray(y_positions, dtype=np.float64), kind='stable')
+                    results = [items_with_y[i] for i in order]
                     
+                    logger.debug("OCR: 成功解析 %d 个文本块", len(results))
                     return results
                 
-                if progress_callback:
-                    progress_callback.update("OCR: PaddleOCR未返回有效结果")
                 return []
             elif self._backend == "easyocr":
                 # EasyOCR返回格式: [([坐标], 文本, 置信度), ...]
-                result = self._ocr.readtext(image_array)
+                with self._infer_lock:
+                    result = self._ocr.readtext(image_array)
                 return [(item[1], item[2]) for item in result]
             elif self._backend == "tesseract":
                 # Tesseract返回文本和置信度
@@ -205,8 +290,8 @@ class OCREngine:
                     pil_image = PILImage.fromarray(image_array)
                 else:
                     pil_image = image
-                text = self._ocr.image_to_string(pil_image, lang='chi_sim+eng')
-                data = self._ocr.image_to_data(pil_image, lang='chi_sim+eng', output_type=self._ocr.Output.DICT)
+                with self._infer_lock:
+                    data = self._ocr.image_to_data(pil_image, lang='chi_sim+eng', output_type=self._ocr.Output.DICT)
                 results = []
                 for i, conf in enumerate(data['conf']):
                     if int(conf) > 0:
@@ -220,88 +305,204 @@ class OCREngine:
         
         return []
     
-    def detect_math_formulas(self, image, progress_callback=None) -> List[Tuple[str, float, Tuple[int, int, int, int]]]:
+    # EasyOCR 批量识别按高度分桶的桶高（像素），同桶图像填充到相同尺寸
+    _HEIGHT_BUCKET = 64
+
+    def recognize_images(self, images, progress_callback=None) -> List[List[Tuple[str, float, Tuple[int, int, int, int]]]]:
         """
-        检测图像中的数学公式
+        识别多张图像（PaddleOCR 逐张识别，EasyOCR 按高度分桶批量识别）；
+        返回的识别框可同时用于文本提取和公式检测，无需再次调用模型
         
         Args:
-            image: PIL Image对象或numpy数组
+            images: PIL Image对象或numpy数组的列表
             progress_callback: 可选的进度回调函数
             
         Returns:
-            List of (latex_formula, confidence, bbox) tuples
+            与 images 一一对应的 List of (text, confidence, bbox) tuples，
+            bbox 为相对各自图像的 (x1, y1, x2, y2)，每张图像内按Y坐标从上到下排序
         """
         self._initialize(progress_callback)
         
+        if not images:
+            return []
         if self._ocr is None or not HAS_IMAGE_LIBS:
+            return [[] for _ in images]
+        
+        try:
+            arrays = [self.to_rgb_array(image) for image in images]
+            if self._backend == "paddleocr":
+                return self._ocr_each(arrays)
+            elif self._backend == "easyocr":
+                return self._ocr_bucketed(arrays)
+        except Exception as e:
+            print(f"批量OCR错误: {e}，改为逐张识别")
+        
+        # 不支持批量的后端（或批量失败）：逐张识别，没有识别框信息
+        return [
+            [(text, conf, (0, 0, 0, 0)) for text, conf in self.extract_text_from_image(image, progress_callback)]
+            for image in images
+        ]
+
+    def recognize(self, image, progress_callback=None) -> List[Tuple[str, float, Tuple[int, int, int, int]]]:
+        """
+        识别单张图像，只调用一次模型，返回 (text, confidence, bbox) 列表
+        """
+        results = self.recognize_images([image], progress_callback)
+        return results[0] if results else []
+
+    def extract_text_from_images(self, images, progress_callback=None) -> List[List[Tuple[str, float]]]:
+        """
+        批量提取文本
+        
+        Returns:
+            与 images 一一对应的 List of (text, confidence) tuples
+        """
+        return [
+            [(text, conf) for text, conf, _ in results]
+            for results in self.recognize_images(images, progress_callback)
+        ]
+
+    def to_rgb_array(self, image):
+        """将 PIL Image 转换为 RGB numpy 数组（已是 RGB 时不复制），numpy 数组原样返回"""
+        if hasattr(image, 'convert'):  # PIL Image
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            return np.asarray(image)
+        return image
+
+    def _ocr_each(self, arrays) -> List[List[Tuple[str, float, Tuple[int, int, int, int]]]]:
+        """
+        PaddleOCR 逐张识别（每张图像单独做检测+识别，结果与单图识别完全一致）
+        """
+        per_image: List[list] = []
+        for array in arrays:
+            result = self.ocr_page(array)
+            lines = []
+            if result and result[0]:
+                # 一次性计算所有识别框的外接矩形
+                extents = self._bbox_extents(result[0])
+                for i, item in enumerate(result[0]):
+                    try:
+                        text = item[1][0] if isinstance(item[1][0], str) else str(item[1][0])
+                        conf = float(item[1][1])
+                        if extents is not None:
+                            x_min, y_min, x_max, y_max = extents[i].tolist()
+                        else:
+                            x_coords = [point[0] for point in item[0]]
+                            y_coords = [point[1] for point in item[0]]
+                            x_min, y_min = min(x_coords), min(y_coords)
+                            x_max, y_max = max(x_coords), max(y_coords)
+                    except (IndexError, TypeError, ValueError) as e:
+                        print(f"PaddleOCR结果解析错误: {e}, item: {item}")
+                        continue
+                    lines.append((text, conf, (int(x_min), int(y_min), int(x_max), int(y_max))))
+            # 按Y坐标排序（从上到下，稳定排序）
+            lines.sort(key=lambda line: line[2][1])
+            per_image.append(lines)
+        return per_image
+
+    def _ocr_bucketed(self, arrays) -> List[List[Tuple[str, float, Tuple[int, int, int, int]]]]:
+        """
+        EasyOCR 批量识别：按高度分桶，桶内填充到相同尺寸后调用 readtext_batched
+        （只在右侧和下方填充，识别框坐标无需换算）
+        """
+        buckets = {}
+        for idx, a in enumerate(arrays):
+            buckets.setdefault(a.shape[0] // self._HEIGHT_BUCKET, []).append(idx)
+        
+        per_image: List[list] = [[] for _ in arrays]
+        for indices in buckets.values():
+            h = max(arrays[i].shape[0] for i in indices)
+            w = max(arrays[i].shape[1] for i in indices)
+            batch = np.stack([
+                np.pad(
+                    arrays[i],
+                    ((0, h - arrays[i].shape[0]), (0, w - arrays[i].shape[1]), (0, 0)),
+                    constant_values=255,
+                )
+                for i in indices
+            ])
+            with self._infer_lock:
+                results = self._ocr.readtext_batched(batch, n_width=w, n_height=h)
+            for i, result in zip(indices, results):
+                # EasyOCR返回格式: [([坐标], 文本, 置信度), ...]
+                extents = self._bbox_extents(result) if result else None
+                per_image[i] = [
+                    (
+                        item[1],
+                        item[2],
+                        tuple(int(v) for v in extents[j]) if extents is not None else (0, 0, 0, 0),
+                    )
+                    for j, item in enumerate(result)
+                ]
+        return per_image
+    
+    def formulas_from_results(self, results) -> List[Tuple[str, float, Tuple[int, int, int, int]]]:
+        """
+        从已有的识别结果中筛选可能的数学公式（不再调用模型）
+        
+        Args:
+            results: recognize / recognize_images 返回的 (text, confidence, bbox) 列表
+            
+        Returns:
+            List of (latex_formula, confidence, bbox) tuples
+        """
+        # 与原先的 detect_math_formulas 一致，只对 PaddleOCR 的结果做公式筛选；
+        # easyocr / tesseract 不产生公式块
+        if self._backend != "paddleocr":
             return []
+        formulas = []
+        for text, conf, bbox in results:
+            # 简单的公式检测：包含数学符号的文本
+            if not _MATH_INDICATORS.isdisjoint(text):
+                # 尝试转换为LaTeX（简化版）
+                latex = self._text_to_latex(text)
+                if latex:
+                    formulas.append((latex, conf, bbox))
+        return formulas
+    
+    def detect_math_formulas(self, image, progress_callback=None) -> List[Tuple[str, float, Tuple[int, int, int, int]]]:
+        """
+        检测图像中的数学公式
         
+        Args:
+            image: PIL Image对象或numpy数组
+            progress_callback: 可选的进度回调函数
+            
+        Returns:
+            List of (latex_formula, confidence, bbox) tuples
+        """
         # 这里可以集成专门的数学公式识别模型
         # 例如：MathPix API、Nougat、或PaddleOCR的数学公式检测模块
-        # 目前先返回空列表，后续可以扩展
-        
+        # 目前基于OCR文本中的数学符号做简单筛选；已有识别结果时请直接用 formulas_from_results
         try:
-            # 确保图像是numpy数组
-            if hasattr(image, 'size'):  # PIL Image
-                image_array = np.array(image)
-            else:
-                image_array = image
-            
-            # 使用PaddleOCR检测可能的公式区域
-            if self._backend == "paddleocr":
-                # PaddleOCR 3.x 不再支持 cls 参数
-                result = self._ocr.ocr(image_array)
-                formulas = []
-                if result and result[0]:
-                    for item in result[0]:
-                        try:
-                            # 检查数据结构
-                            if len(item) < 2:
-                                continue
-                            
-                            # 获取文本和置信度
-                            if isinstance(item[1], (tuple, list)) and len(item[1]) >= 2:
-                                text = item[1][0] if isinstance(item[1][0], str) else str(item[1][0])
-                                conf = float(item[1][1]) if len(item[1]) > 1 else 0.0
-                            else:
-                                continue
-                            
-                            # 获取边界框
-                            bbox = item[0] if len(item) > 0 and isinstance(item[0], (list, tuple)) else None
-                            if not bbox:
-                                continue
-                            
-                            # 简单的公式检测：包含数学符号的文本
-                            math_indicators = ['=', '∑', '∫', '√', '≤', '≥', '≠', '±', '×', '÷', 
-                                             'α', 'β', 'γ', 'π', 'θ', 'λ', 'μ', 'σ', '∞', '∂']
-                            if any(indicator in text for indicator in math_indicators):
-                                # 尝试转换为LaTeX（简化版）
-                                latex = self._text_to_latex(text)
-                                if latex:
-                                    # 计算边界框
-                                    try:
-                                        x_coords = [point[0] for point in bbox if len(point) >= 2]
-                                        y_coords = [point[1] for point in bbox if len(point) >= 2]
-                                        if x_coords and y_coords:
-                                            bbox_tuple = (
-                                                int(min(x_coords)),
-                                                int(min(y_coords)),
-                                                int(max(x_coords)),
-                                                int(max(y_coords))
-                                            )
-                                            formulas.append((latex, conf, bbox_tuple))
-                                    except (IndexError, TypeError, ValueError) as e:
-                                        print(f"边界框计算错误: {e}, bbox: {bbox}")
-                                        continue
-                        except (IndexError, TypeError, ValueError) as e:
-                            print(f"PaddleOCR公式检测结果解析错误: {e}, item: {item}")
-                            continue
-                return formulas
+            return self.formulas_from_results(self.recognize(image, progress_callback))
         except Exception as e:
             print(f"公式检测错误: {e}")
         
         return []
     
+    @staticmethod
+    def _bbox_extents(items):
+        """
+        一次性计算所有识别框的外接矩形
+        
+        Args:
+            items: PaddleOCR 结果列表，每项为 [[坐标点...], (文本, 置信度)]
+            
+        Returns:
+            形状 (N, 4) 的数组，每行为 (x_min, y_min, x_max, y_max)；
+            识别框不规则（点数不一致或格式异常）时返回 None，由调用方逐项计算
+        """
+        try:
+            pts = np.asarray([item[0] for item in items], dtype=np.float64)
+        except (IndexError, TypeError, ValueError):
+            return None
+        if pts.ndim != 3 or pts.shape[1] == 0 or pts.shape[2] < 2:
+            return None
+        pts = pts[..., :2]
+        return np.concatenate((pts.min(axis=1), pts.max(axis=1)), axis=1)
+    
     def _text_to_latex(self, text: str) -> Optional[str]:
         """
         将文本转换为LaTeX格式（简化版）
@@ -321,6 +522,38 @@ class OCREngine:
         return text
 
 
+# 进程内共享的OCR引擎：参数元组 -> OCREngine
+_ENGINES: dict = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def get_ocr_engine(
+    backend: str = "paddleocr",
+    lang: str = "ch",
+    use_angle_cls: bool = True,
+    hpi: bool = False,
+    precision: Optional[str] = None,
+) -> OCREngine:
+    """
+    获取进程内共享的OCR引擎（按参数缓存），
+    多次转换/多个解析器复用同一份已加载的模型；
+    初始化失败的引擎不会被复用，下次调用时重新创建（临时性故障不会永久禁用OCR）
+    """
+    key = (backend, lang, use_angle_cls, hpi, precision)
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(key)
+        if engine is None or engine.failed:
+            engine = OCREngine(
+                backend=backend,
+                lang=lang,
+                use_angle_cls=use_angle_cls,
+                hpi=hpi,
+                precision=precision,
+            )
+            _ENGINES[key] = engine
+        return engine
+
+
 class MathFormulaRecognizer:
     """专门的数学公式识别器"""
     
@@ -1,14 +1,34 @@
 # core/page_parser.py
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import List, Union, Callable, Optional
 from pdfminer.layout import LTTextContainer
 from PIL import Image
 from .models import PageContent, TextBlock, FormulaBlock
-from .ocr_engine import OCREngine
+from .ocr_engine import get_ocr_engine
 from .image_splitter import ImageSplitter
 
+logger = logging.getLogger(__name__)
+
+
+def _save_and_close(image: Image.Image, path: Path) -> None:
+    """保存调试用段落图片后释放其内存（在后台线程执行）"""
+    try:
+        image.save(path, optimize=False, compress_level=1)
+    finally:
+        image.close()
+
 
 class PDFPageParser:
-    def __init__(self, use_ocr: bool = False, ocr_backend: str = "paddleocr", progress_callback=None):
+    def __init__(
+        self,
+        use_ocr: bool = False,
+        ocr_backend: str = "paddleocr",
+        progress_callback=None,
+        debug_save_paragraphs: bool = False,
+    ):
         """
         初始化PDF页面解析器
         
@@ -16,11 +36,22 @@ class PDFPageParser:
             use_ocr: 是否使用OCR（启用后整页使用OCR识别）
             ocr_backend: OCR后端，可选 "paddleocr", "easyocr", "tesseract"
             progress_callback: 可选的进度回调函数
+            debug_save_paragraphs: 是否将段落图片保存到 test_paragraph 文件夹（用于调试）
         """
         self._use_ocr = use_ocr
-        self._ocr_engine = OCREngine(backend=ocr_backend) if use_ocr else None
+        self._debug_save_paragraphs = debug_save_paragraphs
+        self._save_executor: Optional[ThreadPoolExecutor] = None
+        self._ocr_engine = get_ocr_engine(ocr_backend, 'ch', True) if use_ocr else None
         self._progress_callback = progress_callback
         self._image_splitter = ImageSplitter() if use_ocr else None
+        
+        # 后台预热OCR模型，与PDF光栅化等准备工作重叠；首次识别前会等待其完成
+        self._warmup_thread = None
+        if self._ocr_engine is not None:
+            self._warmup_thread = threading.Thread(
+                target=self._ocr_engine.warmup, name="ocr-warmup", daemon=True
+            )
+            self._warmup_thread.start()
 
     def parse(self, page_number: int, layout_items: Union[list, Image.Image], block_callback: Optional[Callable] = None) -> PageContent:
         """
@@ -33,98 +64,125 @@ class PDFPageParser:
                 - 如果未启用OCR，这是 pdfminer 的 layout 列表
             block_callback: 可选的块回调函数，每识别到一个块就调用 (block, page_number)
         """
-        blocks: List[object] = []
+        if self._use_ocr:
+            return self._parse_ocr(page_number, layout_items, block_callback)
+        return self._parse_text(page_number, layout_items, block_callback)
 
-        # OCR模式：先按行裁剪图片，然后逐个段落OCR并流式输出
-        if self._use_ocr and isinstance(layout_items, Image.Image):
-            if self._progress_callback:
-                self._progress_callback.update(f"第 {page_number} 页：正在分割图片为段落...")
-            
-            # 第一步：将页面图片按行分割成段落图片
-            line_images = self._image_splitter.split_into_lines(layout_items, self._ocr_engine)
-            
-            if self._progress_callback:
-                self._progress_callback.update(f"第 {page_number} 页：检测到 {len(line_images)} 个段落，开始OCR识别...")
+    def _parse_ocr(self, page_number: int, layout_items: Union[list, Image.Image], block_callback: Optional[Callable] = None) -> PageContent:
+        """OCR模式：先按行裁剪图片，然后逐个段落OCR并流式输出"""
+        if not isinstance(layout_items, Image.Image):
+            # 收到的不是页面图片（如 layout 列表）时按纯文本模式处理
+            return self._parse_text(page_number, layout_items, block_callback)
+        
+        blocks: List[object] = []
+        
+        # 等待预热完成，避免与预热推理同时使用同一个模型
+        if self._warmup_thread is not None:
+            self._warmup_thread.join()
+            self._warmup_thread = None
+        
+        if self._progress_callback:
+            self._progress_callback.update(f"第 {page_number} 页：正在分割图片为段落...")
+        
+        # 第一步：将页面图片按行分割成段落图片；分割时已对整页做过检测+识别，
+        # 各段落直接带回其中的行识别结果，不再对段落图片重复调用模型
+        paragraphs = self._image_splitter.split_into_paragraphs(layout_items, self._ocr_engine)
+        
+        if self._progress_callback:
+            self._progress_callback.update(f"第 {page_number} 页：检测到 {len(paragraphs)} 个段落，开始OCR识别...")
+        
+        # 保存段落图片到test_paragraph文件夹（仅调试时）
+        page_dir = None
+        if self._debug_save_paragraphs:
+            page_dir = Path("test_paragraph") / f"page_{page_number}"
+            page_dir.mkdir(parents=True, exist_ok=True)
+            if self._save_executor is None:
+                self._save_executor = ThreadPoolExecutor(max_workers=2)
+        
+        # 第二步：分割阶段没有识别结果的段落（未做整页识别或分割失败）在这里补识别；
+        # 段落图片都是整宽裁剪，直接取整页数组的行切片（零拷贝）
+        batch_results = [lines for _, _, _, lines in paragraphs]
+        pending = [i for i, lines in enumerate(batch_results) if lines is None]
+        if pending:
+            page_array = self._ocr_engine.to_rgb_array(layout_items)
+            recognized = self._ocr_engine.recognize_images(
+                [page_array[paragraphs[i][1]:paragraphs[i][2]] for i in pending],
+                self._progress_callback,
+            )
+            for i, lines in zip(pending, recognized):
+                batch_results[i] = lines
+            del page_array, recognized
+        
+        # 第三步：按段落顺序逐个输出（识别结果同时用于文本提取和公式检测）
+        for idx, ((line_image, y_start, y_end, _), raw_results) in enumerate(
+            zip(paragraphs, batch_results), start=1
+        ):
+            # 保存段落图片（后台线程编码写盘，不阻塞识别；写盘后由后台线程释放）
+            if page_dir is not None:
+                para_image_path = page_dir / f"paragraph_{idx:03d}_y{y_start}-{y_end}.png"
+                self._save_executor.submit(_save_and_close, line_image, para_image_path)
+                logger.debug("第 %d 页：段落 %d 图片将保存到 %s", page_number, idx, para_image_path)
+            else:
+                # 识别结果已经就绪，段落裁剪图不再需要，立即释放
+                line_image.close()
+            del line_image
             
-            # 保存段落图片到test_paragraph文件夹（用于调试）
-            import os
-            from pathlib import Path
-            test_dir = Path("test_paragraph")
-            test_dir.mkdir(exist_ok=True)
-            page_dir = test_dir / f"page_{page_number}"
-            page_dir.mkdir(exist_ok=True)
+            # 调试信息（仅在开启 DEBUG 日志时格式化输出）
+            logger.debug("第 %d 页：段落 %d OCR完成，结果数: %d", page_number, idx, len(raw_results))
             
-            # 第二步：逐个段落进行OCR，识别完一段就立即输出
-            for idx, (line_image, y_start, y_end) in enumerate(line_images, start=1):
-                # 保存段落图片
-                para_image_path = page_dir / f"paragraph_{idx:03d}_y{y_start}-{y_end}.png"
-                line_image.save(para_image_path)
-                if self._progress_callback:
-                    self._progress_callback.update(f"第 {page_number} 页：段落 {idx} 图片已保存到 {para_image_path}")
-                
-                if self._progress_callback:
-                    self._progress_callback.update(f"第 {page_number} 页：正在识别第 {idx}/{len(line_images)} 个段落...")
-                
-                # 对当前段落图片进行OCR
-                text_results = self._ocr_engine.extract_text_from_image(line_image, self._progress_callback)
-                
-                # 调试信息
-                if self._progress_callback:
-                    result_count = len(text_results) if text_results else 0
-                    self._progress_callback.update(f"第 {page_number} 页：段落 {idx} OCR完成，结果数: {result_count}")
+            if raw_results:
+                # 过滤并合并文本（降低置信度阈值，避免过滤掉有效结果）；
+                # 生成器直接交给 join，不再构建中间列表
+                paragraph_text = ' '.join(
+                    text for text, conf, _ in raw_results if conf > 0.3
+                ).strip()
                 
-                if text_results:
-                    # 过滤并合并文本（降低置信度阈值，避免过滤掉有效结果）
-                    filtered_texts = [text for text, conf in text_results if conf > 0.3]
-                    
+                if paragraph_text:
                     if self._progress_callback:
-                        self._progress_callback.update(f"第 {page_number} 页：段落 {idx} 过滤后文本数: {len(filtered_texts)}")
+                        preview_text = paragraph_text[:50] + "..." if len(paragraph_text) > 50 else paragraph_text
+                        self._progress_callback.update(f"第 {page_number} 页：段落 {idx} 识别到文本: {preview_text}")
                     
-                    if filtered_texts:
-                        paragraph_text = ' '.join(filtered_texts).strip()
-                        
-                        if paragraph_text:
-                            if self._progress_callback:
-                                preview_text = paragraph_text[:50] + "..." if len(paragraph_text) > 50 else paragraph_text
-                                self._progress_callback.update(f"第 {page_number} 页：段落 {idx} 识别到文本: {preview_text}")
-                            
-                            block = TextBlock(content=paragraph_text)
-                            blocks.append(block)
-                            
-                            # 流式回调：立即输出这个段落块
-                            if block_callback:
-                                if self._progress_callback:
-                                    self._progress_callback.update(f"第 {page_number} 页：段落 {idx} 调用block_callback输出")
-                                block_callback(block, page_number)
-                            else:
-                                if self._progress_callback:
-                                    self._progress_callback.update(f"第 {page_number} 页：段落 {idx} 警告：block_callback为None")
-                else:
-                    if self._progress_callback:
-                        self._progress_callback.update(f"第 {page_number} 页：段落 {idx} OCR未返回结果")
-                
-                # 检测当前段落中的数学公式
-                formulas = self._ocr_engine.detect_math_formulas(line_image, self._progress_callback)
-                for latex, conf, bbox in formulas:
-                    if conf > 0.6:
-                        block = FormulaBlock(content=latex, inline=False)
-                        blocks.append(block)
-                        
-                        # 流式回调：立即输出这个公式块
-                        if block_callback:
-                            block_callback(block, page_number)
+                    block = TextBlock(content=paragraph_text)
+                    blocks.append(block)
+                    
+                    # 流式回调：立即输出这个段落块
+                    if block_callback:
+                        block_callback(block, page_number)
+                    else:
+                        logger.debug("第 %d 页：段落 %d 警告：block_callback为None", page_number, idx)
+            else:
+                logger.debug("第 %d 页：段落 %d OCR未返回结果", page_number, idx)
+            
+            # 检测当前段落中的数学公式
+            formulas = self._ocr_engine.formulas_from_results(raw_results)
+            for latex, conf, bbox in formulas:
+                if conf > 0.6:
+                    block = FormulaBlock(content=latex, inline=False)
+                    blocks.append(block)
+                    
+                    # 流式回调：立即输出这个公式块
+                    if block_callback:
+                        block_callback(block, page_number)
+        
+        # 整页处理完毕，及时释放页面图片及段落结果，避免长文档中峰值内存随页数增长
+        del paragraphs, batch_results
+        layout_items.close()
+
+        return PageContent(page_number=page_number, blocks=blocks)
+
+    def _parse_text(self, page_number: int, layout_items: Union[list, Image.Image], block_callback: Optional[Callable] = None) -> PageContent:
+        """纯文本模式：使用pdfminer提取文本"""
+        blocks: List[object] = []
         
-        # 纯文本模式：使用pdfminer提取文本
-        else:
-            for item in layout_items:
-                if isinstance(item, LTTextContainer):
-                    text = item.get_text().strip()
-                    if text:
-                        block = TextBlock(content=text)
-                        blocks.append(block)
-                        
-                        # 流式回调：立即输出这个块
-                        if block_callback:
-                            block_callback(block, page_number)
+        for item in layout_items:
+            if isinstance(item, LTTextContainer):
+                text = item.get_text().strip()
+                if text:
+                    block = TextBlock(content=text)
+                    blocks.append(block)
+                    
+                    # 流式回调：立即输出这个块
+                    if block_callback:
+                        block_callback(block, page_number)
 
         return PageContent(page_number=page_number, blocks=blocks)
@@ -1,13 +1,60 @@
 # core/pdf_loader.py
 from pathlib import Path
-from typing import Iterator, Optional
+from typing import Iterable, Iterator, Optional
 from pdfminer.high_level import extract_pages
 from pdfminer.layout import LTTextContainer, LTChar
 from PIL import Image
+import functools
 import io
-import subprocess
+import queue
+import shutil
+import threading
 from typing import Union
 
+# 可选依赖：进程内逐页渲染的 pypdfium2
+try:
+    import pypdfium2
+    HAS_PYPDFIUM2 = True
+except ImportError:
+    pypdfium2 = None
+    HAS_PYPDFIUM2 = False
+
+# 可选依赖：pdf2image + poppler 子进程（pypdfium2 不可用时的回退）
+try:
+    from pdf2image import convert_from_path, pdfinfo_from_path
+    HAS_PDF2IMAGE = True
+except ImportError:
+    HAS_PDF2IMAGE = False
+
+
+# OCR 模式下每次调用 pdf2image 光栅化的页数（限制峰值内存）
+_RASTER_CHUNK_PAGES = 8
+# 光栅化/文本提取线程最多领先消费者的页数（有界队列提供背压）
+_PREFETCH_PAGES = 4
+# 光栅化结束标记
+_DONE = object()
+# OCR 模式渲染分辨率
+_RASTER_DPI = 200
+# pdfium 不是线程安全的，所有 pypdfium2 调用都需持有此锁
+_PDFIUM_LOCK = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def poppler_available() -> bool:
+    """检查 poppler 是否在 PATH 中（只查找可执行文件，不启动子进程；每个进程只检查一次）"""
+    return shutil.which('pdftoppm') is not None
+
+
+def _put(page_queue: queue.Queue, item, stop: threading.Event) -> bool:
+    """向有界队列放入元素，消费者提前退出时放弃并返回 False"""
+    while not stop.is_set():
+        try:
+            page_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
 
 class PDFPageLoader:
     def __init__(self, pdf_path: Path, use_ocr: bool = False):
@@ -20,31 +67,15 @@ class PDFPageLoader:
         """
         self._pdf_path = pdf_path
         self._use_ocr = use_ocr
+        self._pdfium = None
         
         if self._use_ocr:
-            try:
-                from pdf2image import convert_from_path
-                # 检查 poppler 是否可用
-                try:
-                    # 尝试检查 poppler 是否在 PATH 中
-                    result = subprocess.run(
-                        ['pdftoppm', '-v'],
-                        capture_output=True,
-                        timeout=2
-                    )
-                    self._pdf2image = convert_from_path
-                    self._poppler_available = True
-                except (FileNotFoundError, subprocess.TimeoutExpired):
-                    # poppler 未安装或不在 PATH 中
-                    self._poppler_available = False
-                    self._use_ocr = False
-                    raise RuntimeError(
-                        "Poppler 未安装。\n"
-                        "macOS: brew install poppler\n"
-                        "Linux: sudo apt-get install poppler-utils\n"
-                        "Windows: 下载 poppler 并添加到 PATH"
-                    )
-            except ImportError:
+            # 优先使用进程内逐页渲染的 pypdfium2（可选依赖），
+            # 未安装时回退到 pdf2image + poppler 子进程
+            self._pdfium = pypdfium2
+        
+        if self._use_ocr and self._pdfium is None:
+            if not HAS_PDF2IMAGE:
                 self._use_ocr = False
                 raise RuntimeError(
                     "pdf2image 未安装。\n"
@@ -53,21 +84,35 @@ class PDFPageLoader:
                     "  macOS: brew install poppler\n"
                     "  Linux: sudo apt-get install poppler-utils"
                 )
+            # 检查 poppler 是否可用（探测结果按进程缓存）
+            self._poppler_available = poppler_available()
+            if not self._poppler_available:
+                # poppler 未安装或不在 PATH 中
+                self._use_ocr = False
+                raise RuntimeError(
+                    "Poppler 未安装。\n"
+                    "macOS: brew install poppler\n"
+                    "Linux: sudo apt-get install poppler-utils\n"
+                    "Windows: 下载 poppler 并添加到 PATH"
+                )
+            self._pdf2image = convert_from_path
+            self._pdfinfo = pdfinfo_from_path
 
-    def iter_pages(self) -> Iterator[Union[list, Image.Image]]:
+    def iter_pages(self, page_numbers: Optional[Iterable[int]] = None) -> Iterator[Union[list, Image.Image]]:
         """
         迭代PDF页面
         
+        Args:
+            page_numbers: 仅文本模式有效，要提取的页码（从 0 开始）；None 表示全部页面
+        
         Returns:
             如果启用OCR，返回 PIL Image 对象
-            如果未启用OCR，返回 pdfminer 的 layout 列表
+            如果未启用OCR，返回 pdfminer 页面中的文本容器（LTTextContainer）列表
         """
         if self._use_ocr:
-            # OCR模式：将PDF转换为图像
+            # OCR模式：后台线程分批将PDF转换为图像，与下游的分割/OCR重叠执行
             try:
-                images = self._pdf2image(self._pdf_path, dpi=200)
-                for image in images:
-                    yield image  # 直接返回PIL Image对象
+                yield from self._iter_ocr_pages()
             except Exception as e:
                 error_msg = str(e)
                 if "poppler" in error_msg.lower() or "Unable to get page count" in error_msg:
@@ -81,7 +126,130 @@ class PDFPageLoader:
                     ) from e
                 else:
                     raise RuntimeError(f"OCR模式失败: {error_msg}") from e
+        elif page_numbers is None:
+            # 文本提取模式：后台线程逐页做 pdfminer 版面分析，经有界队列交给下游，
+            # 与下游的解析/写入/界面刷新重叠执行，内存只保留少量预取页
+            yield from self._iter_queued(
+                self._extract_text_worker, "pdf-extract", "PDF 文本提取线程意外退出"
+            )
         else:
-            # 文本提取模式：直接提取文本
-            for layout in extract_pages(self._pdf_path):
-                yield list(layout)
+            # 只提取指定页（如并行解析的工作进程）：直接在当前线程提取
+            yield from self._extract_text_pages(page_numbers)
+
+    def page_count(self) -> int:
+        """获取PDF总页数（不渲染、不解析页面内容）"""
+        if self._use_ocr and self._pdfium is not None:
+            with _PDFIUM_LOCK:
+                pdf = self._pdfium.PdfDocument(str(self._pdf_path))
+                try:
+                    return len(pdf)
+                finally:
+                    pdf.close()
+        if self._use_ocr:
+            return int(self._pdfinfo(self._pdf_path)["Pages"])
+        
+        from pdfminer.pdfpage import PDFPage
+        with open(self._pdf_path, 'rb') as fp:
+            return sum(1 for _ in PDFPage.get_pages(fp))
+
+    def _extract_text_pages(self, page_numbers: Optional[Iterable[int]] = None) -> Iterator[list]:
+        """逐页提取文本容器；只保留解析器会用到的文本容器，图形/曲线等对象随页面一起释放"""
+        for layout in extract_pages(self._pdf_path, page_numbers=page_numbers):
+            yield [item for item in layout if isinstance(item, LTTextContainer)]
+
+    def _extract_text_worker(self, page_queue: queue.Queue, stop: threading.Event) -> None:
+        """文本提取线程：逐页放入队列"""
+        try:
+            for items in self._extract_text_pages():
+                if not _put(page_queue, items, stop):
+                    return
+            _put(page_queue, _DONE, stop)
+        except Exception as e:
+            # 异常交给消费者线程抛出
+            _put(page_queue, e, stop)
+
+    def _iter_ocr_pages(self) -> Iterator[Image.Image]:
+        """从光栅化线程的有界队列中依次取出页面图像"""
+        return self._iter_queued(self._rasterize_worker, "pdf-rasterize", "PDF 光栅化线程意外退出")
+
+    def _iter_queued(self, target, name: str, died_message: str) -> Iterator:
+        """
+        启动生产者线程，并从其有界队列中依次取出页面
+
+        Args:
+            target: 生产者函数 (page_queue, stop)，结束时放入 _DONE，出错时放入异常
+            name: 线程名
+            died_message: 生产者线程意外退出时的错误信息
+        """
+        page_queue: queue.Queue = queue.Queue(maxsize=_PREFETCH_PAGES)
+        stop = threading.Event()
+        worker = threading.Thread(
+            target=target,
+            args=(page_queue, stop),
+            name=name,
+            daemon=True,
+        )
+        worker.start()
+        
+        try:
+            while True:
+                try:
+                    item = page_queue.get(timeout=0.5)
+                except queue.Empty:
+                    if not worker.is_alive() and page_queue.empty():
+                        raise RuntimeError(died_message)
+                    continue
+                if item is _DONE:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # 消费者结束或提前退出时通知光栅化线程停止
+            stop.set()
+
+    def _rasterize_worker(self, page_queue: queue.Queue, stop: threading.Event) -> None:
+        """光栅化线程：每次转换 _RASTER_CHUNK_PAGES 页，逐页放入队列"""
+        try:
+            if self._pdfium is not None:
+                self._rasterize_pdfium(page_queue, stop)
+                return
+            
+            total_pages = self.page_count()
+            for first_page in range(1, total_pages + 1, _RASTER_CHUNK_PAGES):
+                last_page = min(first_page + _RASTER_CHUNK_PAGES - 1, total_pages)
+                images = self._pdf2image(
+                    self._pdf_path,
+                    dpi=_RASTER_DPI,
+                    first_page=first_page,
+                    last_page=last_page,
+                )
+                for image in images:
+                    if not _put(page_queue, image, stop):
+                        return
+            _put(page_queue, _DONE, stop)
+        except Exception as e:
+            # 异常交给消费者线程抛出
+            _put(page_queue, e, stop)
+
+    def _rasterize_pdfium(self, page_queue: queue.Queue, stop: threading.Event) -> None:
+        """光栅化线程（pypdfium2）：在进程内逐页渲染，逐页放入队列"""
+        try:
+            with _PDFIUM_LOCK:
+                pdf = self._pdfium.PdfDocument(str(self._pdf_path))
+                total_pages = len(pdf)
+            try:
+                for index in range(total_pages):
+                    with _PDFIUM_LOCK:
+                        page = pdf[index]
+                        image = page.render(scale=_RASTER_DPI / 72).to_pil()
+                        page.close()
+                    if not _put(page_queue, image, stop):
+                        return
+            finally:
+                with _PDFIUM_LOCK:
+                    pdf.close()
+            _put(page_queue, _DONE, stop)
+        except Exception as e:
+            # 异常交给消费者线程抛出
+            _put(page_queue, e, stop)
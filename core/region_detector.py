@@ -38,26 +38,23 @@ class RegionDetector:
         if not HAS_IMAGE_LIBS:
             return []
         
-        formula_regions = []
+        # 注意：启发式方法尚未实现，此处不再预先把整页转换为灰度数组
+        # （该数组目前没有任何使用者，每页白白复制一次像素）。
+        # 实现密度/投影等启发式时，应对 np.asarray(image.convert('L'))
+        # 使用 numpy 向量化归约（如 (img < 128).sum(axis=1)），而非逐像素循环
         
-        try:
-            # 转换为numpy数组
-            img_array = np.array(image.convert('L'))  # 转为灰度图
-            
-            # 方法1: 检测包含数学符号的区域
-            # 使用简单的图像处理检测可能的公式区域
-            
-            # 方法2: 检测高密度符号区域（公式通常包含更多特殊符号）
-            # 这里使用简单的启发式方法
-            
-            # 方法3: 检测文本提取失败的区域
-            # 如果pdfminer没有提取到文本，可能是公式或图像
-            
-            # 简化实现：返回空列表，让后续逻辑处理
-            # 实际可以使用更复杂的图像处理或机器学习模型
-            
-        except Exception as e:
-            print(f"公式区域检测错误: {e}")
+        # 方法1: 检测包含数学符号的区域
+        # 使用简单的图像处理检测可能的公式区域
+        
+        # 方法2: 检测高密度符号区域（公式通常包含更多特殊符号）
+        # 这里使用简单的启发式方法
+        
+        # 方法3: 检测文本提取失败的区域
+        # 如果pdfminer没有提取到文本，可能是公式或图像
+        
+        # 简化实现：返回空列表，让后续逻辑处理
+        # 实际可以使用更复杂的图像处理或机器学习模型
+        formula_regions = []
         
         return formula_regions
     
@@ -81,8 +78,6 @@ class RegionDetector:
         
         try:
             x1, y1, x2, y2 = bbox
-            # 裁剪区域
-            region = image.crop((x1, y1, x2, y2))
             
             # 简单的启发式检测：
             # 1. 检查区域大小（公式通常比较小）
@@ -90,7 +85,8 @@ class RegionDetector:
             # 3. 检查是否包含特殊符号
             
             # 简化实现：基于区域特征判断
-            width, height = region.size
+            # 只用到区域尺寸，直接由边界框计算，无需裁剪复制像素
+            width, height = x2 - x1, y2 - y1
             if width < 50 or height < 20:  # 太小的区域可能是公式
                 return True
             
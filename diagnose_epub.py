@@ -2,9 +2,27 @@
 """
 诊断脚本：验证 EPUB 预览功能的所有组件
 """
+import mmap
+import re
 import sys
 from pathlib import Path
 
+
+def scan_file(path_str, needles):
+    """
+    单次扫描文件，返回其中出现过的检查字符串集合
+
+    以只读 mmap 直接在字节上匹配（无需整文件解码），
+    所有检查串合并为一个正则，整个文件只扫描一遍。
+    """
+    encoded = {needle.encode("utf-8"): needle for needle in needles}
+    pattern = re.compile(b"|".join(re.escape(b) for b in encoded))
+    with open(path_str, "rb") as f:
+        if Path(path_str).stat().st_size == 0:
+            return set()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return {encoded[m.group()] for m in pattern.finditer(mm)}
+
 print("=" * 60)
 print("EPUB 预览功能诊断")
 print("=" * 60)
@@ -34,7 +52,6 @@ if not all_exist:
 print("\n⚙️  检查代码配置:")
 
 # 检查 index.html
-html_content = Path("ui/epub_viewer/index.html").read_text()
 html_checks = [
     ("CDN EPUB.js", "https://cdn.jsdelivr.net/npm/epubjs"),
     ("调试面板", 'id="debug"'),
@@ -43,15 +60,16 @@ html_checks = [
     ("简化的 URL 构造", "window.location.origin"),
 ]
 
+html_found = scan_file("ui/epub_viewer/index.html", [s for _, s in html_checks])
+
 print("  HTML 检查:")
 for check_name, check_str in html_checks:
-    if check_str in html_content:
+    if check_str in html_found:
         print(f"    ✓ {check_name}")
     else:
         print(f"    ❌ {check_name} (缺少)")
 
 # 检查 app.py
-app_content = Path("ui/app.py").read_text()
 app_checks = [
     ("CORS 头", "Access-Control-Allow-Origin"),
     ("HEAD 方法", "def do_HEAD"),
@@ -59,9 +77,11 @@ app_checks = [
     ("自定义处理器", "class CustomHTTPRequestHandler"),
 ]
 
+app_found = scan_file("ui/app.py", [s for _, s in app_checks])
+
 print("  App.py 检查:")
 for check_name, check_str in app_checks:
-    if check_str in app_content:
+    if check_str in app_found:
         print(f"    ✓ {check_name}")
     else:
         print(f"    ❌ {check_name} (缺少)")
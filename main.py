@@ -1,6 +1,10 @@
 # main.py
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Optional, List
+from typing import Callable, Optional, List
 
 from core.pdf_loader import PDFPageLoader
 from core.page_parser import PDFPageParser
@@ -11,6 +15,32 @@ from core.models import PageContent, TextBlock
 from ui.progress import ProgressCallback
 
 
+# 文本模式并行解析时每个任务处理的页数（每个任务只打开一次PDF）
+_PARALLEL_CHUNK_PAGES = 8
+# 每个工作进程最多同时挂起的任务数（限制已完成但尚未写出的页面占用的内存）
+_PENDING_CHUNKS_PER_WORKER = 2
+
+
+def _process_pages(pdf_path: Path, page_indexes: List[int]) -> List[PageContent]:
+    """
+    工作进程入口：提取并解析一段连续页面（文本模式）
+
+    Args:
+        pdf_path: PDF文件路径
+        page_indexes: 要处理的页码（从 0 开始）
+
+    Returns:
+        与 page_indexes 一一对应的页面内容（已完成公式提取）
+    """
+    loader = PDFPageLoader(pdf_path, use_ocr=False)
+    parser = PDFPageParser(use_ocr=False)
+    formula = FormulaExtractor()
+    return [
+        formula.extract(parser.parse(index + 1, layout))
+        for index, layout in zip(page_indexes, loader.iter_pages(page_numbers=page_indexes))
+    ]
+
+
 class PDFToEPUBPipeline:
     def __init__(
         self,
@@ -20,18 +50,25 @@ class PDFToEPUBPipeline:
         output_format: str = "html",  # "html" 或 "epub"
         use_ocr: bool = False,  # 是否使用OCR
         ocr_backend: str = "paddleocr",  # OCR后端
+        max_workers: Optional[int] = None,  # 文本模式并行解析的进程数，None 为CPU核数，1 为不并行
     ):
+        self._pdf_path = pdf_path
+        self._use_ocr = use_ocr
+        self._max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
         self._loader = PDFPageLoader(pdf_path, use_ocr=use_ocr)
         self._parser = PDFPageParser(use_ocr=use_ocr, ocr_backend=ocr_backend, progress_callback=progress_callback)
         self._formula = FormulaExtractor()
         self._output_format = output_format.lower()
         
         if self._output_format == "html":
-            # 启用流式模式
+            # 启用流式模式，每页刷新一次磁盘以便实时预览；
+            # 按块写入时页内最多每 0.2 秒（与预览刷新间隔一致）再刷新一次
             self._builder = HTMLBuilder(
                 title=pdf_path.stem, 
                 output_path=output_path,
-                streaming=True
+                streaming=True,
+                flush_every_n_pages=1,
+                block_flush_interval=0.2,
             )
         else:
             self._builder = EPUBBuilder(
@@ -40,6 +77,14 @@ class PDFToEPUBPipeline:
             )
         self._output_path = output_path
         self._progress = progress_callback
+        # 转换过程中是否已输出过非空文本块（增量维护，避免事后遍历全部块）
+        self._saw_content = False
+
+    def _note_content(self, blocks) -> None:
+        """记录是否出现过非空文本块；一旦为真即不再检查"""
+        if not self._saw_content:
+            # TextBlock 构造时已去除首尾空白，非空即有内容
+            self._saw_content = any(type(b) is TextBlock and b.content for b in blocks)
 
     def _ensure_non_empty_pages(
         self, pages: List[PageContent]
@@ -64,7 +109,8 @@ class PDFToEPUBPipeline:
                 )
             ]
 
-        has_valid_content = any(
+        # run() 过程中已记录到内容时直接判定为非空；否则（如传入的页面未经 run() 处理）再逐块检查
+        has_valid_content = self._saw_content or any(
             any(
                 isinstance(b, TextBlock) and b.content.strip()
                 for b in page.blocks
@@ -86,41 +132,99 @@ class PDFToEPUBPipeline:
 
     def run(self) -> None:
         # 流式处理：逐页处理并立即写入
-        raw_pages = list(self._loader.iter_pages())
-        total_pages = len(raw_pages)
+        # 只读取页数，页面由加载器按需（OCR模式下由后台线程预取）产生
+        total_pages = self._loader.page_count()
 
         if self._progress:
             self._progress.on_start(total_pages)
 
-        # 流式模式：逐页处理并立即写入（支持按块流式输出）
-        for idx, layout in enumerate(raw_pages, start=1):
-            # 定义块回调：每识别到一个块就立即输出并更新预览
-            def block_callback(block, page_num):
-                """块级流式回调：立即写入HTML并更新预览"""
-                # 应用公式提取（如果需要）
-                if hasattr(block, 'content'):
-                    # 这里可以添加公式检测逻辑
-                    pass
-                # 立即写入HTML
-                self._builder.add_block(block, page_num)
-                # 立即更新UI预览（识别完一段就显示）
-                if self._progress and hasattr(self._progress, 'render_preview'):
-                    self._progress.render_preview()
-            
+        # 文本模式下页面之间互不依赖：多进程并行解析，按页码顺序写出。
+        # OCR模式共享同一个（非线程安全的）模型，且需要按块流式预览，保持逐页处理
+        workers = min(self._max_workers, -(-total_pages // _PARALLEL_CHUNK_PAGES))
+        if not self._use_ocr and workers > 1:
+            self._run_parallel(total_pages, workers)
+        else:
+            self._run_sequential()
+
+        # 完成构建（流式模式下写入尾部并关闭文件）
+        self._builder.build(self._output_path)
+
+        if self._progress:
+            self._progress.on_finish(str(self._output_path))
+
+    def _run_parallel(self, total_pages: int, workers: int) -> None:
+        """
+        多进程并行解析（文本模式）
+
+        按页分块提交给进程池，挂起任务数有上限；任务按提交顺序（即页码顺序）取回，
+        保证流式写出的页面顺序不变。跨进程无法传递块回调，因此按整页写出。
+        进程池用 spawn 启动：调用方（Streamlit 界面）此时已有进度、预览服务器与
+        OCR 预热等线程，fork 出的子进程可能继承被持有的锁而死锁。
+        """
+        chunks = (
+            list(range(start, min(start + _PARALLEL_CHUNK_PAGES, total_pages)))
+            for start in range(0, total_pages, _PARALLEL_CHUNK_PAGES)
+        )
+        max_pending = workers * _PENDING_CHUNKS_PER_WORKER
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(_process_pages, self._pdf_path, chunk))
+                if len(pending) >= max_pending:
+                    self._emit_pages(pending.popleft().result())
+            while pending:
+                self._emit_pages(pending.popleft().result())
+
+    def _emit_pages(self, pages: List[PageContent]) -> None:
+        """将已解析的整页依次写入 builder 并上报进度"""
+        for page in pages:
+            if page.blocks:
+                self._note_content(page.blocks)
+                self._builder.add_page(page)
+            if self._progress:
+                self._progress.on_page_processed(page.page_number)
+
+    def _make_block_callback(self) -> Optional[Callable]:
+        """
+        构造块级流式回调：每识别到一个块就立即输出并更新预览
+
+        每次转换只创建一次，写入与预览方法在创建时绑定；
+        builder 不支持按块写入（如 EPUBBuilder）时返回 None，按整页输出。
+        公式提取逐块进行，写出的内容与整页提取后写入（并行模式）一致。
+        """
+        add_block = getattr(self._builder, 'add_block', None)
+        if add_block is None:
+            return None
+        note_content = self._note_content
+        extract = self._formula.extract
+        render_preview = getattr(self._progress, 'render_preview', None) if self._progress else None
+
+        def block_callback(block, page_num):
+            """块级流式回调：立即写入HTML并更新预览"""
+            for out in extract(PageContent(page_number=page_num, blocks=[block])).blocks:
+                note_content((out,))
+                add_block(out, page_num)
+            # 立即更新UI预览（识别完一段就显示）
+            if render_preview is not None:
+                render_preview()
+
+        return block_callback
+
+    def _run_sequential(self) -> None:
+        """逐页处理并立即写入（支持按块流式输出）"""
+        block_callback = self._make_block_callback()
+        for idx, layout in enumerate(self._loader.iter_pages(), start=1):
             # 解析页面（带块回调，实现按块流式输出）
             page = self._parser.parse(idx, layout, block_callback=block_callback)
-            page = self._formula.extract(page)
             
-            # 如果还有未通过回调处理的块，也添加到builder
-            # （非OCR模式或块回调未处理的情况）
-            if page.blocks:
+            # 解析器会把每个块都交给回调，块已全部写出；
+            # 没有块回调（builder 不支持按块写入）时才按整页写入
+            if block_callback is None and page.blocks:
+                page = self._formula.extract(page)
+                self._note_content(page.blocks)
                 self._builder.add_page(page)
 
             if self._progress:
                 self._progress.on_page_processed(idx)
-
-        # 完成构建（流式模式下写入尾部并关闭文件）
-        self._builder.build(self._output_path)
-
-        if self._progress:
-            self._progress.on_finish(str(self._output_path))
\ No newline at end of file
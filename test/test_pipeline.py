@@ -0,0 +1,307 @@
+# test/test_pipeline.py
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+from lxml import etree
+
+from core.epub_builder import EPUBBuilder
+from core.formula_extractor import FormulaExtractor
+from core.image_splitter import _group_paragraphs, _group_paragraphs_loop, _group_paragraphs_numpy
+from core.models import FormulaBlock, PageContent, TextBlock
+from core.ocr_engine import OCREngine
+from main import PDFToEPUBPipeline
+
+
+_XHTML_NS = {"x": "http://www.w3.org/1999/xhtml"}
+
+
+# ---------------------------------------------------------------------------
+# EPUBBuilder
+# ---------------------------------------------------------------------------
+
+def test_epub_output_parses_strictly(tmp_path):
+    builder = EPUBBuilder(title="A & B <test>", author="Unknown")
+    builder.add_page(PageContent(page_number=1, blocks=[
+        TextBlock(content="a < b & c > d"),
+        FormulaBlock(content="x<y & y>z"),
+    ]))
+    builder.add_page(PageContent(page_number=2, blocks=[]))
+    output = tmp_path / "out.epub"
+    builder.build(output)
+
+    parser = etree.XMLParser(recover=False, resolve_entities=False, no_network=True)
+    with zipfile.ZipFile(output) as zf:
+        names = zf.namelist()
+        assert names[0] == "mimetype"
+        assert zf.read("mimetype") == b"application/epub+zip"
+        for name in names:
+            if name.endswith((".xhtml", ".opf", ".ncx", ".xml")):
+                etree.fromstring(zf.read(name), parser=parser)
+
+        page1 = etree.fromstring(zf.read("OEBPS/page_1.xhtml"), parser=parser)
+        assert page1.xpath("//x:p/text()", namespaces=_XHTML_NS) == ["a < b & c > d"]
+        math = page1.xpath("//*[local-name()='math']")[0]
+        assert math.text == "x<y & y>z"
+
+        # 空页面使用占位文本，而不是空 body
+        page2 = etree.fromstring(zf.read("OEBPS/page_2.xhtml"), parser=parser)
+        assert page2.xpath("//x:p/text()", namespaces=_XHTML_NS) == ["（此页无内容）"]
+
+
+def test_epub_drops_xml_illegal_characters(tmp_path):
+    builder = EPUBBuilder(title="t", author="a")
+    builder.add_page(PageContent(page_number=1, blocks=[
+        TextBlock(content="form\x0cfeed"),
+        TextBlock(content="bell\x07 and \x00nul\ud800"),
+        FormulaBlock(content="x\x0by"),
+    ]))
+    output = tmp_path / "out.epub"
+    builder.build(output)
+
+    parser = etree.XMLParser(recover=False, resolve_entities=False, no_network=True)
+    with zipfile.ZipFile(output) as zf:
+        page = etree.fromstring(zf.read("OEBPS/page_1.xhtml"), parser=parser)
+    # 非法字符被清理，整页内容保留，不会退回占位文本
+    assert page.xpath("//x:p/text()", namespaces=_XHTML_NS) == ["form feed", "bell and nul"]
+    assert page.xpath("//*[local-name()='math']")[0].text == "x y"
+
+
+# ---------------------------------------------------------------------------
+# FormulaExtractor
+# ---------------------------------------------------------------------------
+
+def _extract(*blocks):
+    return FormulaExtractor().extract(PageContent(page_number=1, blocks=list(blocks))).blocks
+
+
+def test_formula_inline_and_block_spans():
+    blocks = _extract(TextBlock(content="let $x+1$ be and $$E = mc^2$$ done"))
+    assert blocks == [
+        TextBlock(content="let"),
+        FormulaBlock(content="x+1", inline=True),
+        TextBlock(content="be and"),
+        FormulaBlock(content="E = mc^2", inline=False),
+        TextBlock(content="done"),
+    ]
+
+
+def test_formula_block_preferred_over_inline():
+    assert _extract(TextBlock(content="$$a$$")) == [FormulaBlock(content="a", inline=False)]
+
+
+def test_formula_environment_keeps_markup():
+    text = "see \\begin{equation}y = x\\end{equation} and \\begin{matrix}1 & 0\\end{matrix}"
+    assert _extract(TextBlock(content=text)) == [
+        TextBlock(content="see"),
+        FormulaBlock(content="\\begin{equation}y = x\\end{equation}"),
+        TextBlock(content="and"),
+        FormulaBlock(content="\\begin{matrix}1 & 0\\end{matrix}"),
+    ]
+
+
+def test_formula_plain_text_and_formula_blocks_pass_through():
+    plain = TextBlock(content="no formulas here")
+    formula = FormulaBlock(content="\\alpha", inline=True)
+    blocks = _extract(plain, formula, TextBlock(content="α ≤ β"))
+    assert blocks[0] is plain
+    assert blocks[1] is formula
+    assert blocks[2] == TextBlock(content="α ≤ β")
+
+
+# ---------------------------------------------------------------------------
+# 段落分组
+# ---------------------------------------------------------------------------
+
+def _random_lines(rng, n):
+    heights = rng.uniform(10, 30, n)
+    gaps = rng.choice([2.0, 5.0, 25.0, 60.0], n)
+    y_min = np.cumsum(heights + gaps)
+    y_max = y_min + heights
+    x_min = rng.choice([50.0, 52.0, 120.0, 400.0], n)
+    x_max = x_min + rng.choice([300.0, 500.0, 80.0], n)
+    return y_min, y_max, x_min, x_max
+
+
+@pytest.mark.parametrize("n", [1, 2, 7, 200])
+def test_group_paragraphs_numpy_matches_loop(n):
+    rng = np.random.default_rng(n)
+    for _ in range(20):
+        y_min, y_max, x_min, x_max = _random_lines(rng, n)
+        gap = float(rng.uniform(5, 40))
+        expected = _group_paragraphs_loop(y_min, y_max, x_min, x_max, gap)
+        for impl in (_group_paragraphs_numpy, _group_paragraphs):
+            starts, ends = impl(y_min, y_max, x_min, x_max, gap)
+            np.testing.assert_array_equal(starts, expected[0])
+            np.testing.assert_array_equal(ends, expected[1])
+
+
+def test_group_paragraphs_splits_on_gap_and_indent():
+    y_min = np.array([0.0, 22.0, 44.0, 120.0, 142.0])
+    y_max = y_min + 20
+    x_min = np.array([50.0, 50.0, 50.0, 50.0, 300.0])
+    x_max = np.array([550.0, 550.0, 550.0, 550.0, 550.0])
+    starts, ends = _group_paragraphs_numpy(y_min, y_max, x_min, x_max, 15.0)
+    assert starts.tolist() == [0, 3, 4]
+    assert ends.tolist() == [2, 3, 4]
+
+
+# ---------------------------------------------------------------------------
+# OCR 结果中的公式筛选
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize("backend, expected", [
+    ("paddleocr", [("∑ x ≤ 1", 0.9, (0, 0, 10, 10))]),
+    ("easyocr", []),
+    ("tesseract", []),
+])
+def test_formulas_from_results_only_for_paddleocr(backend, expected):
+    results = [("∑ x ≤ 1", 0.9, (0, 0, 10, 10)), ("plain text", 0.9, (0, 20, 10, 30))]
+    # 只读取已有结果，不会加载模型
+    assert OCREngine(backend=backend).formulas_from_results(results) == expected
+
+
+# ---------------------------------------------------------------------------
+# 并行 / 顺序解析
+# ---------------------------------------------------------------------------
+
+def _make_pdf(path: Path, page_count: int) -> Path:
+    """写出一个最小的多页文本 PDF（每页两行，第二行带 $x^2$ 公式）"""
+    objects: list[bytes] = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for i in range(1, page_count + 1):
+        stream = (
+            f"BT /F1 12 Tf 72 720 Td (Page {i} first paragraph) Tj "
+            f"0 -200 Td (second para $x^2$ on {i}) Tj ET"
+        ).encode("ascii")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    # 对象编号：1 为字体，2..n+1 为内容流，n+2..2n+1 为页面，随后是 Pages 与 Catalog
+    pages_id = 2 * page_count + 2
+    page_ids = []
+    for i in range(page_count):
+        objects.append(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 1 0 R >> >> /Contents %d 0 R >>" % (pages_id, i + 2)
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects.append(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, page_count))
+    objects.append(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, len(objects), xref
+    )
+    path.write_bytes(data)
+    return path
+
+
+class _RecordingBuilder:
+    """记录整页写入顺序的 builder；按块写入的内容单独记录"""
+
+    def __init__(self):
+        self.pages = []
+        self.streamed = []
+
+    def add_block(self, block, page_number):
+        self.streamed.append((page_number, block))
+
+    def add_page(self, page):
+        self.pages.append(page)
+
+
+class _RecordingProgress:
+    def __init__(self):
+        self.processed = []
+
+    def on_page_processed(self, page_number):
+        self.processed.append(page_number)
+
+
+def _run_with(pipeline, method, *args):
+    builder, progress = _RecordingBuilder(), _RecordingProgress()
+    pipeline._builder = builder
+    pipeline._progress = progress
+    getattr(pipeline, method)(*args)
+    return builder, progress.processed
+
+
+def test_parallel_output_matches_sequential_order(tmp_path):
+    page_count = 20  # 多于 _PARALLEL_CHUNK_PAGES 的若干块，最后一块不满
+    pdf_path = _make_pdf(tmp_path / "in.pdf", page_count)
+    pipeline = PDFToEPUBPipeline(pdf_path, tmp_path / "out.epub", output_format="epub")
+
+    seq, seq_progress = _run_with(pipeline, "_run_sequential")
+    par, par_progress = _run_with(pipeline, "_run_parallel", page_count, 3)
+
+    # 顺序模式逐块写出（已做公式提取），不再重复写入整页
+    assert seq.pages == []
+    streamed: dict = {}
+    for page_number, block in seq.streamed:
+        streamed.setdefault(page_number, []).append(block)
+
+    assert par.streamed == []
+    assert [p.page_number for p in par.pages] == list(range(1, page_count + 1))
+    assert [(p.page_number, p.blocks) for p in par.pages] == list(streamed.items())
+    assert seq_progress == par_progress == list(range(1, page_count + 1))
+    assert FormulaBlock(content="x^2", inline=True) in par.pages[-1].blocks
+
+
+def test_html_output_independent_of_worker_count(tmp_path):
+    page_count = 20
+    pdf_path = _make_pdf(tmp_path / "in.pdf", page_count)
+    sequential = tmp_path / "seq.html"
+    parallel = tmp_path / "par.html"
+    PDFToEPUBPipeline(pdf_path, sequential, output_format="html", max_workers=1).run()
+    PDFToEPUBPipeline(pdf_path, parallel, output_format="html", max_workers=3).run()
+
+    html = sequential.read_text(encoding="utf-8")
+    # 每页只写一次
+    assert html.count('<article class="page">') == page_count
+    assert html.count("</article>") == page_count
+    assert parallel.read_text(encoding="utf-8") == html
+
+
+def test_run_writes_every_page_to_epub(tmp_path):
+    pdf_path = _make_pdf(tmp_path / "in.pdf", 10)
+    output = tmp_path / "out.epub"
+    PDFToEPUBPipeline(pdf_path, output, output_format="epub", max_workers=2).run()
+    with zipfile.ZipFile(output) as zf:
+        chapters = [n for n in zf.namelist() if n.startswith("OEBPS/page_")]
+    assert chapters == [f"OEBPS/page_{n}.xhtml" for n in range(1, 11)]
+
+
+# ---------------------------------------------------------------------------
+# 预览服务器 Range 解析
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-9", (0, 9)),
+    ("bytes=95-200", (95, 99)),
+    ("bytes=90-", (90, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-200", (0, 99)),
+    ("bytes=-0", (-1, -1)),
+    ("bytes=100-", (-1, -1)),
+    ("bytes=100-120", (-1, -1)),
+    ("bytes=5-2", None),
+    ("bytes=0-9,20-29", None),
+    ("bytes=abc-", None),
+    ("bytes=-", None),
+    ("bytes=10", None),
+    ("items=0-9", None),
+])
+def test_parse_range(header, expected):
+    pytest.importorskip("streamlit")
+    from ui.app import CustomHTTPRequestHandler
+
+    assert CustomHTTPRequestHandler._parse_range(header, 100) == expected
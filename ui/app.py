@@ -1,13 +1,26 @@
 # ui/app.py
+import base64
+import codecs
+import email.utils
+import errno
+import functools
+import gzip
 import os
+import shutil
+import socket
+import stat
 import sys
 import tempfile
 import threading
-import subprocess
+import time
+import queue
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 import mimetypes
+import re
 
 # 添加项目根目录到 Python 路径
 _project_root = Path(__file__).parent.parent
@@ -16,151 +29,483 @@ if str(_project_root) not in sys.path:
 
 import streamlit as st
 
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx
+except ImportError:  # older Streamlit releases
+    add_script_run_ctx = None
+
 from main import PDFToEPUBPipeline
+from core.pdf_loader import poppler_available
 from ui.progress import ProgressCallback
 
 
 _STATIC_SERVER_PORT = 8899
-_SERVER: Optional[ThreadingHTTPServer] = None
-_SERVER_PORT: Optional[int] = None
-_TEMP_DIR: Optional[tempfile.TemporaryDirectory] = None  # Keep temp dir alive for the session
+
+# Preview extraction patterns, compiled once (used on every progress tick)
+_STYLE_RE = re.compile(r"<style[^>]*>(.*?)</style>", re.DOTALL | re.IGNORECASE)
+_BODY_RE = re.compile(r"<body[^>]*>(.*?)</body>", re.DOTALL | re.IGNORECASE)
+_BODY_OPEN_RE = re.compile(rb"<body[^>]*>", re.IGNORECASE)
+# DOCTYPE / html / head / body wrappers, stripped in a single pass
+_STRIP_RE = re.compile(
+    r"<!DOCTYPE[^>]*>|<html[^>]*>|</html>|<head[^>]*>.*?</head>|<body[^>]*>|</body>",
+    re.DOTALL | re.IGNORECASE,
+)
+
+
+# Extension -> (content type, worth gzip-compressing) for the assets the viewer serves;
+# EPUB, images and fonts are already compressed
+_MIME_TYPES = {
+    '.html': ('text/html', True),
+    '.htm': ('text/html', True),
+    '.js': ('application/javascript', True),
+    '.css': ('text/css', True),
+    '.json': ('application/json', True),
+    '.svg': ('image/svg+xml', True),
+    '.xhtml': ('application/xhtml+xml', True),
+    '.epub': ('application/epub+zip', False),
+    '.png': ('image/png', False),
+    '.woff2': ('font/woff2', False),
+}
+# Compressible types for extensions outside the table above
+_COMPRESSIBLE_TYPES = frozenset({
+    'application/javascript', 'text/javascript', 'application/json',
+    'application/xml', 'application/xhtml+xml', 'image/svg+xml',
+})
+# full_path -> ((mtime_ns, size), gzip bytes); text assets are small and few
+_GZIP_CACHE: dict = {}
+
+
+def _gzipped_file(full_path: str, st_result: os.stat_result, raw: Optional[bytes] = None) -> bytes:
+    """Gzip-compressed contents of a file, recompressed only when it changes.
+    
+    `raw` is the file's contents when the caller already holds them in memory.
+    """
+    key = (st_result.st_mtime_ns, st_result.st_size)
+    cached = _GZIP_CACHE.get(full_path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    if raw is None:
+        with open(full_path, 'rb') as f:
+            raw = f.read()
+    data = gzip.compress(raw, compresslevel=6)
+    _GZIP_CACHE[full_path] = (key, data)
+    return data
+
+
+def _content_type(extension: str) -> Tuple[str, bool]:
+    """(content type, compressible) for a file extension; mimetypes is consulted only on a table miss."""
+    extension = extension.lower()
+    known = _MIME_TYPES.get(extension)
+    if known is not None:
+        return known
+    return _guess_content_type(extension)
+
+
+@functools.lru_cache(maxsize=64)
+def _guess_content_type(extension: str) -> Tuple[str, bool]:
+    mime_type, _ = mimetypes.guess_type('file' + extension)
+    mime_type = mime_type or 'application/octet-stream'
+    return mime_type, mime_type.startswith('text/') or mime_type in _COMPRESSIBLE_TYPES
+
+
+class _PooledHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer that hands requests to a fixed worker pool instead of
+    starting a new thread per request (epub.js issues bursts of small Range requests)."""
+    
+    # SO_REUSEADDR: rebinding the preferred port right after a shutdown is not
+    # blocked by connections left in TIME_WAIT. SO_REUSEPORT stays off: it would let
+    # a second app process bind the same port and receive a share of this
+    # server's requests, served from the wrong directory.
+    allow_reuse_address = True
+    allow_reuse_port = False
+    # I/O-bound workers: a few per core, capped so a request burst cannot grow the pool
+    _POOL_SIZE = min(32, (os.cpu_count() or 4) * 4)
+    
+    def __init__(self, *args, **kwargs):
+        # Create the pool first: a failed bind calls server_close() from inside __init__
+        self._pool = ThreadPoolExecutor(max_workers=self._POOL_SIZE, thread_name_prefix="preview-http")
+        super().__init__(*args, **kwargs)
+    
+    def process_request(self, request, client_address):
+        self._pool.submit(self.process_request_thread, request, client_address)
+    
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False)
+
+
+# Files at least this large are always read from disk, never held in the asset cache
+_ASSET_CACHE_MAX_FILE = 4 * 1024 * 1024
+
+
+def _load_asset_cache(directory: str) -> dict:
+    """Read the static viewer assets under `directory` into memory.
+    
+    Returns {request path: (full_path, stat_result, mime_type, compressible, data)};
+    directory index paths ("preview/", "preview") map to their index.html.
+    EPUB files are skipped: they are rewritten by every conversion and are
+    served from disk with sendfile.
+    """
+    cache = {}
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        rel_dir = os.path.relpath(dirpath, directory).replace(os.sep, '/')
+        rel_dir = '' if rel_dir == '.' else rel_dir + '/'
+        for name in filenames:
+            if name.startswith('.') or name.lower().endswith('.epub'):
+                continue
+            full_path = os.path.join(dirpath, name)
+            try:
+                # lstat: symlinks are left to the disk path and its containment check
+                st_result = os.lstat(full_path)
+                if not stat.S_ISREG(st_result.st_mode) or st_result.st_size > _ASSET_CACHE_MAX_FILE:
+                    continue
+                with open(full_path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            entry = (full_path, st_result) + _content_type(os.path.splitext(name)[1]) + (data,)
+            cache[rel_dir + name] = entry
+            if name == 'index.html':
+                cache[rel_dir] = entry
+                cache[rel_dir.rstrip('/')] = entry
+    return cache
+
+
+def _is_within(path: str, real_root: str) -> bool:
+    """Whether `path` resolves (following symlinks) to `real_root` or a path below it.
+    
+    Resolved on every call: a directory under the root may be replaced by a
+    symlink at any time, so the answer must never be cached.
+    """
+    return os.path.commonpath((os.path.realpath(path), real_root)) == real_root
+
+
+def _set_serve_directory(handler_class, directory: str) -> None:
+    """Point a handler class at a new directory (realpath resolved and assets cached once here)."""
+    # Load first so a request never sees the new directory with the old cache
+    asset_cache = _load_asset_cache(directory) if os.path.isdir(directory) else {}
+    handler_class._asset_cache = {}
+    handler_class._serve_directory = directory
+    handler_class._real_serve_directory = os.path.realpath(directory)
+    handler_class._asset_cache = asset_cache
 
 
 class CustomHTTPRequestHandler(BaseHTTPRequestHandler):
     """Custom handler that serves files from a specific directory."""
     
     _serve_directory: Optional[str] = None
+    # realpath() of _serve_directory, resolved once when the server is configured
+    _real_serve_directory: Optional[str] = None
+    # Read size for the fallback copy loop when sendfile is unavailable
+    _COPY_BUFSIZE = 128 * 1024
+    # In-memory viewer assets of the serve directory (see _load_asset_cache)
+    _asset_cache: dict = {}
+    # Validators of the response being sent (set by _check_not_modified)
+    _etag: Optional[str] = None
+    _last_modified: Optional[str] = None
+    # Small assets go out as soon as they are written instead of waiting on Nagle
+    disable_nagle_algorithm = True
+    # Socket send buffer, so large EPUB bodies need fewer sendfile round trips
+    _SNDBUF = 1 << 20
     
-    def do_GET(self):
-        """Handle GET request by serving files from the configured directory."""
-        # Remove query string
-        request_path = self.path.split('?')[0]
-        
-        # Remove leading slash
-        if request_path.startswith('/'):
-            request_path = request_path[1:]
+    def setup(self):
+        super().setup()
+        try:
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self._SNDBUF)
+        except OSError:
+            pass  # Keep the OS default
+    
+    def _resolve(self) -> Optional[Tuple[str, os.stat_result, str, bool]]:
+        """Map the request path to a file under the serve directory.
         
-        # Construct full file path
-        if self._serve_directory:
-            full_path = os.path.normpath(os.path.join(self._serve_directory, request_path))
-        else:
+        Sends the error response itself and returns None when the path cannot
+        be served; otherwise returns (full_path, stat_result, mime_type, compressible).
+        """
+        if not self._serve_directory or not self._real_serve_directory:
             self.send_error(500, "Server not configured")
-            return
+            return None
         
-        # Security check: ensure the path is within serve_directory
-        real_serve_dir = os.path.realpath(self._serve_directory)
-        real_full_path = os.path.realpath(full_path)
-        if not real_full_path.startswith(real_serve_dir):
-            self.send_error(403, "Forbidden")
-            return
+        # Remove query string and leading slash
+        request_path = self.path.split('?')[0].lstrip('/')
         
-        # Check if path is a file or directory
-        if os.path.isdir(full_path):
-            # Try to serve index.html from the directory
-            index_path = os.path.join(full_path, 'index.html')
-            if os.path.isfile(index_path):
-                full_path = index_path
-            else:
-                self.send_error(404, "Not Found")
-                return
+        # Security check: refuse ".." segments and join onto the pre-resolved
+        # serve directory; below, the file itself must not be a symlink and its
+        # parent directory must resolve inside serve_directory (checked afresh
+        # on every request)
+        if '..' in request_path.split('/'):
+            self.send_error(403, "Forbidden")
+            return None
+        real_serve_dir = self._real_serve_directory
+        full_path = os.path.normpath(os.path.join(real_serve_dir, request_path))
+        if os.path.commonpath((full_path, real_serve_dir)) != real_serve_dir:
+            self.send_error(403, "Forbidden")
+            return None
         
-        # Try to serve the file
-        if not os.path.isfile(full_path):
+        # A single lstat answers "exists", "symlink", "directory or file" and "size"
+        try:
+            st_result = os.lstat(full_path)
+            if stat.S_ISDIR(st_result.st_mode):
+                # Try to serve index.html from the directory
+                full_path = os.path.join(full_path, 'index.html')
+                st_result = os.lstat(full_path)
+        except OSError:
             self.send_error(404, "Not Found")
-            return
+            return None
+        if stat.S_ISLNK(st_result.st_mode) or not _is_within(os.path.dirname(full_path), real_serve_dir):
+            self.send_error(403, "Forbidden")
+            return None
+        if not stat.S_ISREG(st_result.st_mode):
+            self.send_error(404, "Not Found")
+            return None
         
-        # Guess content type
-        mime_type, _ = mimetypes.guess_type(full_path)
-        if mime_type is None:
-            mime_type = 'application/octet-stream'
+        return (full_path, st_result) + _content_type(os.path.splitext(full_path)[1])
+    
+    def _check_not_modified(self, st_result: os.stat_result, variant: str = '') -> bool:
+        """Compute the validators for this response and answer 304 if the client's copy is current.
         
-        try:
-            with open(full_path, 'rb') as f:
-                file_size = os.path.getsize(full_path)
-                
-                self.send_response(200)
-                self.send_header('Content-Type', mime_type)
-                self.send_header('Content-Length', str(file_size))
-                self.send_header('Cache-Control', 'no-cache')
-                # Add CORS headers to allow cross-origin requests
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, OPTIONS')
-                self.send_header('Access-Control-Allow-Headers', 'Content-Type, Range')
-                # Allow Range requests for seeking in EPUB
-                self.send_header('Accept-Ranges', 'bytes')
-                self.end_headers()
-                
-                self.wfile.write(f.read())
-        except Exception as e:
-            self.send_error(500, f"Internal Server Error: {e}")
+        Args:
+            st_result: stat of the file being served
+            variant: suffix distinguishing encodings of the same file (e.g. "gz")
+        
+        Returns:
+            True if a 304 response was sent (nothing more to do)
+        """
+        self._etag = f'"{st_result.st_mtime_ns:x}-{st_result.st_size:x}{variant}"'
+        self._last_modified = email.utils.formatdate(st_result.st_mtime, usegmt=True)
+        
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # If-None-Match takes precedence over If-Modified-Since
+            tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+            fresh = '*' in tags or self._etag in tags
+        else:
+            if_modified_since = self.headers.get('If-Modified-Since')
+            fresh = False
+            if if_modified_since:
+                try:
+                    since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+                    fresh = int(st_result.st_mtime) <= since
+                except (TypeError, ValueError):
+                    fresh = False
+        if not fresh:
+            return False
+        
+        self.send_response(304)
+        self.send_header('ETag', self._etag)
+        self.send_header('Last-Modified', self._last_modified)
+        self.send_header('Cache-Control', 'max-age=0, must-revalidate')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        return True
     
-    def do_OPTIONS(self):
-        """Handle OPTIONS requests for CORS preflight."""
-        self.send_response(200)
+    def _send_file_headers(self, mime_type: str, length: int) -> None:
+        """Send the headers shared by GET and HEAD responses and finish the header block."""
+        self.send_header('Content-Type', mime_type)
+        self.send_header('Content-Length', str(length))
+        # Clients may keep a copy but must revalidate it (cheap 304 when unchanged)
+        self.send_header('Cache-Control', 'max-age=0, must-revalidate')
+        if self._etag is not None:
+            self.send_header('ETag', self._etag)
+            self.send_header('Last-Modified', self._last_modified)
+        # Add CORS headers to allow cross-origin requests
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type, Range')
+        self.send_header('Access-Control-Expose-Headers', 'Content-Range, Content-Length, Accept-Ranges')
+        # Allow Range requests for seeking in EPUB
         self.send_header('Accept-Ranges', 'bytes')
         self.end_headers()
     
-    def do_HEAD(self):
-        """Handle HEAD requests by sending headers without body."""
-        # Remove query string
-        request_path = self.path.split('?')[0]
-        
-        # Remove leading slash
-        if request_path.startswith('/'):
-            request_path = request_path[1:]
+    def do_GET(self):
+        """Handle GET request by serving files from the configured directory."""
+        try:
+            body = self._send_head()
+            if isinstance(body, bytes):
+                self.wfile.write(body)
+            elif body is not None:
+                f, offset, count = body
+                with f:
+                    self._send_file_body(f, offset, count)
+        except ConnectionError:
+            # The client went away mid-body (epub.js aborts superseded fetches):
+            # headers are already out and there is nobody left to tell
+            self.close_connection = True
+        except Exception as e:
+            self.send_error(500, f"Internal Server Error: {e}")
+    
+    def _send_head(self):
+        """Resolve the request and send the status line and headers shared by GET and HEAD.
         
-        # Construct full file path
-        if self._serve_directory:
-            full_path = os.path.normpath(os.path.join(self._serve_directory, request_path))
+        Returns:
+            the body still to be sent: bytes (cached gzip body), an
+            (open file, offset, count) tuple the caller must close, or None
+            when the response is already complete (error, 304, 416)
+        """
+        # Viewer assets are answered from memory without touching the filesystem
+        # (range requests go to disk: only the EPUB is fetched by range)
+        cached = None
+        if not self.headers.get('Range'):
+            cached = self._asset_cache.get(self.path.split('?')[0].lstrip('/'))
+        if cached is not None:
+            full_path, st_result, mime_type, compressible, data = cached
         else:
-            self.send_error(500, "Server not configured")
-            return
+            resolved = self._resolve()
+            if resolved is None:
+                return None
+            full_path, st_result, mime_type, compressible = resolved
+            data = None
         
-        # Security check: ensure the path is within serve_directory
-        real_serve_dir = os.path.realpath(self._serve_directory)
-        real_full_path = os.path.realpath(full_path)
-        if not real_full_path.startswith(real_serve_dir):
-            self.send_error(403, "Forbidden")
-            return
-        
-        # Check if path is a file or directory
-        if os.path.isdir(full_path):
-            # Try to serve index.html from the directory
-            index_path = os.path.join(full_path, 'index.html')
-            if os.path.isfile(index_path):
-                full_path = index_path
-            else:
-                self.send_error(404, "Not Found")
-                return
+        # Text assets: send a cached gzip body when the client accepts it
+        # (range requests always get the identity encoding)
+        if (
+            compressible
+            and 'gzip' in self.headers.get('Accept-Encoding', '')
+            and not self.headers.get('Range')
+        ):
+            if self._check_not_modified(st_result, '-gz'):
+                return None
+            body = _gzipped_file(full_path, st_result, data)
+            self.send_response(200)
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Vary', 'Accept-Encoding')
+            self._send_file_headers(mime_type, len(body))
+            return body
         
-        # Try to serve the file
-        if not os.path.isfile(full_path):
-            self.send_error(404, "Not Found")
-            return
+        if self._check_not_modified(st_result):
+            return None
+        if data is not None:
+            self.send_response(200)
+            self._send_file_headers(mime_type, len(data))
+            return data
+        f = open(full_path, 'rb')
+        try:
+            span = self._send_range_headers(mime_type, st_result.st_size)
+        except BaseException:
+            f.close()
+            raise
+        if span is None:
+            f.close()
+            return None
+        return (f,) + span
+    
+    def _send_range_headers(self, mime_type: str, file_size: int) -> Optional[Tuple[int, int]]:
+        """Send the status line and headers for a full or single-range response.
         
-        # Guess content type
-        mime_type, _ = mimetypes.guess_type(full_path)
-        if mime_type is None:
-            mime_type = 'application/octet-stream'
+        Honors a single "Range: bytes=..." so epub.js can fetch just the parts
+        of the ZIP it needs instead of the whole file.
         
-        try:
-            file_size = os.path.getsize(full_path)
-            
-            self.send_response(200)
-            self.send_header('Content-Type', mime_type)
-            self.send_header('Content-Length', str(file_size))
-            self.send_header('Cache-Control', 'no-cache')
-            # Add CORS headers to allow cross-origin requests
+        Returns:
+            (offset, length) of the body to send, or None after a 416 response
+        """
+        byte_range = self._parse_range(self.headers.get('Range'), file_size)
+        if byte_range == (-1, -1):
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{file_size}')
+            self.send_header('Content-Length', '0')
             self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, OPTIONS')
-            self.send_header('Access-Control-Allow-Headers', 'Content-Type, Range')
-            # Allow Range requests for seeking in EPUB
-            self.send_header('Accept-Ranges', 'bytes')
             self.end_headers()
-            # Don't send body for HEAD request
+            return None
+        
+        if byte_range is None:
+            start, length = 0, file_size
+            self.send_response(200)
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{file_size}')
+        self._send_file_headers(mime_type, length)
+        return start, length
+    
+    @staticmethod
+    def _parse_range(header: Optional[str], file_size: int):
+        """Parse a single-range "bytes=start-end" header.
+        
+        Returns:
+            (start, end) inclusive byte offsets for a satisfiable range,
+            (-1, -1) if the range cannot be satisfied (416),
+            or None when the header is absent, malformed or multi-range
+            (the whole file is served with 200).
+        """
+        if not header or not header.startswith('bytes=') or ',' in header:
+            return None
+        first, sep, last = header[6:].strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else file_size - 1
+                if last and start > end:
+                    return None
+            elif last:
+                # Suffix range: the final N bytes
+                suffix = int(last)
+                if suffix == 0:
+                    return (-1, -1)
+                start = max(file_size - suffix, 0)
+                end = file_size - 1
+            else:
+                return None
+        except ValueError:
+            return None
+        if start >= file_size:
+            return (-1, -1)
+        return start, min(end, file_size - 1)
+    
+    def _send_file_body(self, f, offset: int, count: int) -> None:
+        """Send `count` bytes of `f` starting at `offset` to the client.
+        
+        Uses os.sendfile so the kernel copies straight from the page cache to
+        the socket without materializing the file in Python; falls back to a
+        buffered copy loop where sendfile is not available.
+        """
+        # sendfile writes to the socket directly: anything still buffered in
+        # wfile (the headers) must reach the socket first
+        self.wfile.flush()
+        if hasattr(os, 'sendfile'):
+            out_fd = self.connection.fileno()
+            in_fd = f.fileno()
+            try:
+                while count > 0:
+                    sent = os.sendfile(out_fd, in_fd, offset, count)
+                    if sent == 0:
+                        return  # File shrank underneath us
+                    offset += sent
+                    count -= sent
+                return
+            except OSError as e:
+                # Not supported for this file/socket pair: fall through to the copy loop
+                if e.errno not in (errno.EINVAL, errno.ENOTSOCK, errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise
+        
+        f.seek(offset)
+        while count > 0:
+            chunk = f.read(min(self._COPY_BUFSIZE, count))
+            if not chunk:
+                return
+            self.wfile.write(chunk)
+            count -= len(chunk)
+    
+    def do_OPTIONS(self):
+        """Handle OPTIONS requests for CORS preflight."""
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Range')
+        # Let the browser cache the preflight instead of repeating it before every Range request
+        self.send_header('Access-Control-Max-Age', '86400')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
+    def do_HEAD(self):
+        """Handle HEAD requests: the same status and headers as GET, without the body."""
+        try:
+            body = self._send_head()
+            if isinstance(body, tuple):
+                body[0].close()
         except Exception as e:
             self.send_error(500, f"Internal Server Error: {e}")
     
@@ -170,6 +515,11 @@ class CustomHTTPRequestHandler(BaseHTTPRequestHandler):
 
 
 class StreamlitProgress(ProgressCallback):
+    # 块级预览、状态文字刷新的最小间隔（秒）
+    _PREVIEW_INTERVAL = 0.2
+    # 进度条刷新的最小间隔（秒）
+    _BAR_INTERVAL = 0.1
+
     def __init__(
         self,
         html_path: Optional[Path] = None,
@@ -180,83 +530,275 @@ class StreamlitProgress(ProgressCallback):
         self._total = 0
         self._html_path = html_path
         self._preview_placeholder = preview_placeholder
+        # 预览刷新状态：上次块级刷新的时间、上次渲染时文件的 (大小, mtime_ns)
+        self._last_preview_ts = 0.0
+        self._last_html_signature: Optional[Tuple[int, int]] = None
+        # 进度条/状态文字上次更新的时间；进度条上次推送的页码与推送步长（约 1%）
+        self._last_bar_ts = 0.0
+        self._last_bar_page = 0
+        self._bar_step = 1
+        # 状态文字模板（总页数在 on_start 中填入），每次推送只需填页码
+        self._status_tmpl = "正在处理第 {} 页"
+        self._last_status_ts = 0.0
+        # 解析线程报告的最新页码与状态消息，由后台 UI 线程读取并推送
+        self._latest_page = 0
+        self._latest_message: Optional[str] = None
+        self._reset_preview_state()
+        
+        # 进度条、状态文字和预览都在后台 UI 线程推送，解析线程只记录页码并投递请求，
+        # 不等待前端；队列容量为 1，推送期间到达的多次请求合并为一次
+        self._ui_q: "queue.Queue[Optional[bool]]" = queue.Queue(maxsize=1)
+        self._ui_thread: Optional[threading.Thread] = None
+        self._closed = False
+        if add_script_run_ctx is not None:
+            self._ui_thread = threading.Thread(
+                target=self._ui_loop, name="progress-ui", daemon=True
+            )
+            # 让后台线程可以更新当前会话的 Streamlit 元素
+            add_script_run_ctx(self._ui_thread)
+            self._ui_thread.start()
+        # 无法给线程附加 ScriptRunContext 时（旧版 Streamlit），后台线程的更新会被丢弃，
+        # 此时在调用线程中同步推送
+
+    def _ui_loop(self) -> None:
+        """后台 UI 线程：逐个处理刷新请求，收到 None 时退出"""
+        while True:
+            if self._ui_q.get() is None:
+                return
+            try:
+                self._push_progress()
+                self._render_streaming_preview()
+            except Exception as e:
+                print(f"[PREVIEW] render failed: {e}", flush=True)
+
+    def _request_update(self) -> None:
+        """请求一次界面刷新（不阻塞；已有待处理请求时直接合并；没有后台线程时同步刷新）"""
+        if self._ui_thread is None:
+            if not self._closed:
+                self._push_progress()
+                self._render_streaming_preview()
+            return
+        try:
+            self._ui_q.put_nowait(True)
+        except queue.Full:
+            pass
+
+    def close(self) -> None:
+        """停止后台 UI 线程，并在当前线程完成最后一次进度与预览刷新（可重复调用）"""
+        if self._closed:
+            return
+        self._closed = True
+        thread, self._ui_thread = self._ui_thread, None
+        if thread is not None:
+            self._ui_q.put(None)
+            thread.join()
+        self._push_progress()
+        self._render_streaming_preview()
 
     def _render_streaming_preview(self) -> None:
-        """在转换过程中实时预览（HTML 文件可能尚未写入 footer，所以要补齐关闭标签）。"""
+        """
+        在转换过程中实时预览（HTML 文件可能尚未写入 footer，所以要补齐关闭标签）。
+
+        HTML 只会追加写入：首次读取时缓存 <style> 并记下 <body> 之后的字节偏移，
+        之后每次只读取新增部分并累积到 body 缓冲，刷新代价与新增内容成正比。
+        """
         if self._html_path is None or self._preview_placeholder is None:
             return
-        if not self._html_path.exists():
+        # 先用一次 stat 判断文件是否有变化，大小和 mtime 都没变则跳过读取和重新渲染
+        try:
+            st_result = os.stat(self._html_path)
+        except OSError:
+            return
+        signature = (st_result.st_size, st_result.st_mtime_ns)
+        if signature == self._last_html_signature:
             return
+        size = st_result.st_size
+        if size < self._body_offset:
+            # 文件被重新写入（新的转换）：丢弃已累积的内容
+            self._reset_preview_state()
 
         try:
-            content = self._html_path.read_text(encoding="utf-8")
+            with open(self._html_path, "rb") as f:
+                if self._styles is None:
+                    head = f.read()
+                    body_open = _BODY_OPEN_RE.search(head)
+                    if body_open is None:
+                        return  # 头部尚未写完
+                    style_match = _STYLE_RE.search(head[:body_open.start()].decode("utf-8", "replace"))
+                    self._styles = style_match.group(1) if style_match else ""
+                    self._body_offset = body_open.end()
+                    delta = head[body_open.end():]
+                else:
+                    f.seek(self._body_offset)
+                    delta = f.read()
         except Exception:
             return
+        self._last_html_signature = signature
+        self._body_offset += len(delta)
 
-        # HTML 可能还没写 footer：补齐以便浏览器/Streamlit 能渲染
-        if "</html>" not in content:
-            content += "\n    </div>\n  </div>\n</body>\n</html>\n"
+        if not self._body_done:
+            # 增量解码：跨读取边界被截断的多字节字符留到下次
+            text = self._body_decoder.decode(delta)
+            # 只在新增部分（连同可能跨边界的几个字符）中查找 </body>
+            search_from = max(len(self._body_buf) - 6, 0)
+            self._body_buf += text
+            end = self._body_buf[search_from:].lower().find("</body>")
+            if end != -1:
+                self._body_buf = self._body_buf[:search_from + end]
+                self._body_done = True
 
-        # 提取样式与 body 内容（避免把整份 <html> 嵌进 Streamlit）
-        import re
+        body_content = self._body_buf
+        if not self._body_done:
+            # 去掉末尾写了一半的标签，并补齐页面容器的关闭标签
+            last_open = body_content.rfind("<")
+            if last_open > body_content.rfind(">"):
+                body_content = body_content[:last_open]
+            body_content += "\n    </div>\n  </div>\n"
 
-        style_match = re.search(r"<style>(.*?)</style>", content, re.DOTALL | re.IGNORECASE)
-        styles = style_match.group(1) if style_match else ""
-
-        body_match = re.search(r"<body[^>]*>(.*?)</body>", content, re.DOTALL | re.IGNORECASE)
-        body_content = body_match.group(1) if body_match else content
-
-        final_html = f"<style>{styles}</style>{body_content}"
+        final_html = f"<style>{self._styles}</style>{body_content}"
         self._preview_placeholder.markdown(final_html, unsafe_allow_html=True)
+
+    def _reset_preview_state(self) -> None:
+        """重置增量预览的读取状态"""
+        self._styles = None
+        self._body_offset = 0
+        self._body_buf = ""
+        self._body_done = False
+        self._body_decoder = codecs.getincrementaldecoder("utf-8")("replace")
     
     def render_preview(self) -> None:
-        """公开方法：立即更新预览（供外部调用）"""
-        self._render_streaming_preview()
+        """公开方法：更新预览（供外部按块调用，最多每 _PREVIEW_INTERVAL 秒刷新一次）"""
+        now = time.monotonic()
+        if now - self._last_preview_ts < self._PREVIEW_INTERVAL:
+            return
+        self._last_preview_ts = now
+        self._request_update()
 
     def on_start(self, total_pages: int) -> None:
         self._total = total_pages
+        self._bar_step = max(1, total_pages // 100)
+        self._status_tmpl = f"正在处理第 {{}} / {total_pages} 页"
         self._status.info(f"开始处理 PDF，共 {total_pages} 页")
         if self._preview_placeholder is not None:
             self._preview_placeholder.info("实时预览将在第 1 页生成后显示…")
 
     def on_page_processed(self, page_number: int) -> None:
-        self._progress_bar.progress(page_number / self._total)
-        self._status.info(
-            f"正在处理第 {page_number} / {self._total} 页"
-        )
-        # 每页处理完就刷新一次预览
-        self._render_streaming_preview()
+        # 只记录页码并请求刷新，推送由后台 UI 线程完成（合并连续多页）
+        self._latest_page = page_number
+        self._request_update()
+
+    def _push_progress(self) -> None:
+        """
+        把最新页码与状态消息推送到进度条与状态文字（后台 UI 线程或 close() 中调用）。
+        节流更新（最后一页总是更新），避免每页都触发一次前端重绘；
+        进度条还要求至少前进约 1%，整个转换最多推送约 100 次。
+        有新的状态消息（update）时显示消息，否则显示页码状态
+        """
+        message, self._latest_message = self._latest_message, None
+        page_number = self._latest_page
+        now = time.monotonic()
+        show_page_status = False
+        if page_number > 0 and self._total > 0:
+            is_last = page_number >= self._total
+            if is_last and self._last_bar_page >= self._total:
+                pass  # 最后一页已经推送过
+            else:
+                if is_last or (
+                    page_number - self._last_bar_page >= self._bar_step
+                    and now - self._last_bar_ts >= self._BAR_INTERVAL
+                ):
+                    self._last_bar_ts = now
+                    self._last_bar_page = page_number
+                    self._progress_bar.progress(page_number / self._total)
+                show_page_status = is_last or now - self._last_status_ts >= self._PREVIEW_INTERVAL
+        if message is not None:
+            self._last_status_ts = now
+            self._status.info(message)
+        elif show_page_status:
+            self._last_status_ts = now
+            self._status.info(self._status_tmpl.format(page_number))
 
     def on_finish(self, output_path: str) -> None:
+        self.close()
         self._progress_bar.progress(1.0)
         self._status.success("HTML 转换完成")
     
     def update(self, message: str) -> None:
-        """更新进度消息"""
-        self._status.info(message)
+        """更新进度消息：只记录最新一条并请求刷新，由后台 UI 线程推送（与进度更新合并）"""
+        self._latest_message = message
+        self._request_update()
+
+
+@st.cache_resource
+def _preview_server_registry() -> dict:
+    """Process-wide record of the running preview server.
+    
+    Streamlit re-executes this script on every rerun, so plain module globals
+    do not survive; the cached dict does. Keys: server, port, thread, directory.
+    """
+    return {}
+
+
+@st.cache_resource
+def _preview_server_lock() -> threading.RLock:
+    """Serializes start/stop of the preview server across concurrent sessions.
+    
+    Reentrant because the temp-dir finalizer may stop the server from a thread
+    that is already inside _start_static_server.
+    """
+    return threading.RLock()
+
+
+def _stop_static_server(only_if_serving: Optional[str] = None) -> None:
+    """Shut down the preview server (if running) and release its port.
+    
+    Args:
+        only_if_serving: if given, stop only while the server still serves this
+            directory (a later run may have retargeted it elsewhere)
+    """
+    with _preview_server_lock():
+        registry = _preview_server_registry()
+        if only_if_serving is not None and registry.get('directory') != only_if_serving:
+            return
+        httpd = registry.get('server')
+        if httpd is not None:
+            try:
+                httpd.shutdown()
+                httpd.server_close()
+            except Exception as e:
+                print(f"[SERVER] Error shutting down old server: {e}", flush=True)
+        registry.clear()
 
 
 def _start_static_server(static_root: Path) -> Optional[int]:
-    global _SERVER
-    global _SERVER_PORT
+    """Return the preview server's port, building the server on first use.
+    
+    The server is created once per process; later calls only retarget the
+    directory it serves.
+    """
+    with _preview_server_lock():
+        return _start_static_server_locked(static_root)
 
-    # Always create a fresh server for each preview request (since temp dirs change per Streamlit run)
-    # First, shut down the old server if it exists
-    if _SERVER is not None:
-        try:
-            _SERVER.shutdown()
-            _SERVER.server_close()
-        except Exception as e:
-            print(f"[SERVER] Error shutting down old server: {e}", flush=True)
-        _SERVER = None
-        _SERVER_PORT = None
-        # Give the port time to be released
-        import time
-        time.sleep(0.5)
-
-    # Set the serve directory on the handler class
+
+def _start_static_server_locked(static_root: Path) -> Optional[int]:
+    registry = _preview_server_registry()
     static_root_str = str(static_root)
-    CustomHTTPRequestHandler._serve_directory = static_root_str
+
+    # Reuse the long-lived server while its thread is alive: no bind attempt.
+    # Handlers read the serve directory from their class on each request, so
+    # retargeting it is enough. The class must be the one the server was built
+    # with (each rerun defines a fresh CustomHTTPRequestHandler).
+    httpd = registry.get('server')
+    if httpd is not None:
+        thread = registry.get('thread')
+        if thread is not None and thread.is_alive():
+            _set_serve_directory(httpd.RequestHandlerClass, static_root_str)
+            registry['directory'] = static_root_str
+            return registry['port']
+        # The server died: close it and start a new one below
+        _stop_static_server()
+    
+    _set_serve_directory(CustomHTTPRequestHandler, static_root_str)
     
     # List contents for debugging
     if os.path.exists(static_root_str):
@@ -266,34 +808,15 @@ def _start_static_server(static_root: Path) -> Optional[int]:
     server_address = ("0.0.0.0", _STATIC_SERVER_PORT)
 
     try:
-        httpd = ThreadingHTTPServer(server_address, CustomHTTPRequestHandler)
-        port = server_address[1]
+        httpd = _PooledHTTPServer(server_address, CustomHTTPRequestHandler)
     except OSError as exc:
-        # If the desired port is already in use, probe the existing server to see
-        # if it already serves our preview. If it does, reuse that port. Otherwise
-        # bind to an ephemeral port assigned by the OS.
-        if getattr(exc, 'errno', None) in (48,):
-            # probe existing server for /preview/index.html
-            import urllib.request
-            import urllib.error
-
-            probe_url = f"http://localhost:{server_address[1]}/preview/index.html"
-            try:
-                with urllib.request.urlopen(probe_url, timeout=1) as resp:
-                    if resp.status == 200:
-                        # Existing server already serves preview; reuse desired port
-                        _SERVER_PORT = server_address[1]
-                        return _SERVER_PORT
-            except Exception:
-                # Existing process on port is not serving our preview; fall back
-                # to starting on an ephemeral port
-                pass
-
-            # Start on an ephemeral port
-            httpd = ThreadingHTTPServer(("0.0.0.0", 0), CustomHTTPRequestHandler)
-            port = httpd.server_address[1]
-        else:
+        # The preferred port belongs to another process (this process's server
+        # lives in the registry), so it cannot be serving our directory: let the
+        # OS assign an ephemeral port instead
+        if getattr(exc, 'errno', None) not in (errno.EADDRINUSE, 48):
             raise
+        httpd = _PooledHTTPServer(("0.0.0.0", 0), CustomHTTPRequestHandler)
+    port = httpd.server_address[1]
 
     thread = threading.Thread(
         target=httpd.serve_forever,
@@ -301,10 +824,9 @@ def _start_static_server(static_root: Path) -> Optional[int]:
     )
     thread.start()
 
-    _SERVER = httpd
-    _SERVER_PORT = port
+    registry.update(server=httpd, port=port, thread=thread, directory=static_root_str)
 
-    return _SERVER_PORT
+    return port
 
 
 def render_html_preview(html_path: Path, work_dir: Path) -> None:
@@ -316,9 +838,8 @@ def render_html_preview(html_path: Path, work_dir: Path) -> None:
         st.subheader("HTML 在线预览")
         
         # 提取 body 标签内的内容，直接显示在 Streamlit 页面中
-        import re
-        body_match = re.search(r'<body[^>]*>(.*?)</body>', html_content, re.DOTALL | re.IGNORECASE)
-        style_match = re.search(r'<style[^>]*>(.*?)</style>', html_content, re.DOTALL | re.IGNORECASE)
+        body_match = _BODY_RE.search(html_content)
+        style_match = _STYLE_RE.search(html_content)
         
         if body_match and style_match:
             # 提取样式和内容
@@ -338,12 +859,7 @@ def render_html_preview(html_path: Path, work_dir: Path) -> None:
         else:
             # 如果无法提取，直接显示整个HTML（去掉html和body标签）
             # 移除 DOCTYPE, html, head, body 标签，只保留内容
-            content = re.sub(r'<!DOCTYPE[^>]*>', '', html_content, flags=re.IGNORECASE)
-            content = re.sub(r'<html[^>]*>', '', content, flags=re.IGNORECASE)
-            content = re.sub(r'</html>', '', content, flags=re.IGNORECASE)
-            content = re.sub(r'<head[^>]*>.*?</head>', '', content, flags=re.DOTALL | re.IGNORECASE)
-            content = re.sub(r'<body[^>]*>', '', content, flags=re.IGNORECASE)
-            content = re.sub(r'</body>', '', content, flags=re.IGNORECASE)
+            content = _STRIP_RE.sub('', html_content)
             
             st.markdown(content, unsafe_allow_html=True)
             
@@ -353,41 +869,131 @@ def render_html_preview(html_path: Path, work_dir: Path) -> None:
         st.code(traceback.format_exc())
 
 
+def _scan_viewer_files(root: str, rel: str = "") -> dict:
+    """Recursively collect viewer assets as {relpath: mtime} using os.scandir."""
+    files = {}
+    with os.scandir(os.path.join(root, rel) if rel else root) as it:
+        for entry in it:
+            if entry.name.startswith("."):
+                continue
+            rel_path = os.path.join(rel, entry.name) if rel else entry.name
+            if entry.is_dir():
+                files.update(_scan_viewer_files(root, rel_path))
+            else:
+                files[rel_path] = entry.stat().st_mtime
+    return files
+
+
+def _link_or_copy(src: str, dst: Path) -> None:
+    """Place a file in the preview dir: hardlink when on the same filesystem, else copy2 (keeps mtime)."""
+    try:
+        dst.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+@st.cache_resource
+def _load_viewer_manifest(viewer_src: str, mtime_key: tuple) -> dict:
+    """
+    读取 viewer 资源清单 {相对路径: 修改时间}，在整个 Streamlit 进程内缓存；
+    mtime_key 仅作为缓存键，viewer 目录变化时自动重新扫描
+    """
+    return _scan_viewer_files(viewer_src)
+
+
+# 不超过该大小的 EPUB 以 base64 内联进预览页面，不启动静态服务器；
+# 更大的文件内联后页面过大，仍由静态服务器按 Range 分段提供
+_INLINE_EPUB_MAX_BYTES = 8 * 1024 * 1024
+# viewer 页面中引用 epub.js 的标签，内联模式下替换为脚本内容
+_VIEWER_SCRIPT_TAG = '<script src="./epub.min.js"></script>'
+
+
+@st.cache_resource
+def _inline_viewer_template(viewer_src: str, mtime_key: tuple) -> Optional[Tuple[str, str]]:
+    """
+    内联版 viewer 页面：epub.min.js 直接嵌入，并在 EPUB 数据注入点切成 (前半, 后半)，
+    渲染时只需拼接 base64 数据；viewer 页面结构不符时返回 None
+    """
+    html = Path(viewer_src, "index.html").read_text(encoding="utf-8")
+    head, sep, tail = html.partition(_VIEWER_SCRIPT_TAG)
+    if not sep:
+        return None
+    script = Path(viewer_src, "epub.min.js").read_text(encoding="utf-8")
+    return (
+        f'{head}<script>{script}</script>\n    <script>window.__EPUB_B64 = "',
+        f'";</script>{tail}',
+    )
+
+
 def render_epub_preview(epub_path: Path, work_dir: Path) -> None:
     static_root = work_dir / "static"
     preview_dir = static_root / "preview"
 
-    preview_dir.mkdir(parents=True, exist_ok=True)
-
     viewer_src = Path(__file__).parent / "epub_viewer"
 
-    # Copy epub_viewer → preview/
     if not viewer_src.exists():
         st.error(f"viewer assets not found at {viewer_src}")
         return
+    mtime_key = (viewer_src.stat().st_mtime_ns, (viewer_src / "index.html").stat().st_mtime_ns)
+
+    try:
+        epub_size = epub_path.stat().st_size
+    except FileNotFoundError:
+        st.error("转换后 EPUB 文件未找到")
+        return
 
-    # 快速复制 viewer 资源（只在文件不存在时复制）
-    for p in viewer_src.rglob("*"):
-        if p.name.startswith("."):
-            continue
+    # 小文件：viewer 与 EPUB 一起内联进组件页面，不需要端口、线程和文件复制
+    if epub_size <= _INLINE_EPUB_MAX_BYTES:
+        template = _inline_viewer_template(str(viewer_src), mtime_key)
+        if template is not None:
+            head, tail = template
+            st.subheader("EPUB3 在线预览")
+            st.components.v1.html(
+                head + base64.b64encode(epub_path.read_bytes()).decode("ascii") + tail,
+                height=650,
+                scrolling=True,
+            )
+            return
 
-        target = preview_dir / p.relative_to(viewer_src)
+    # Copy epub_viewer → preview/
+    preview_dir.mkdir(parents=True, exist_ok=True)
 
-        if p.is_dir():
-            target.mkdir(parents=True, exist_ok=True)
-        else:
+    # 部署 viewer 资源：清单只扫描一次并缓存，同一 preview 目录只在清单变化后重新同步；
+    # 优先硬链接，不经过 Python 读写文件内容
+    # 已同步过的 preview 目录 -> 清单缓存键；脚本每次重跑都会重新执行模块级代码，
+    # 所以和会话临时目录一样放在 session_state 中
+    synced_dirs = st.session_state.setdefault("_synced_viewer_dirs", {})
+    sync_key = (str(viewer_src), mtime_key)
+    if synced_dirs.get(str(preview_dir)) != sync_key or not (preview_dir / "index.html").exists():
+        manifest = _load_viewer_manifest(str(viewer_src), mtime_key)
+        for rel_path, mtime in manifest.items():
+            target = preview_dir / rel_path
             # 只在目标文件不存在或源文件更新时才复制
-            if not target.exists() or target.stat().st_mtime < p.stat().st_mtime:
+            try:
+                if target.stat().st_mtime >= mtime:
+                    continue
+            except FileNotFoundError:
                 target.parent.mkdir(parents=True, exist_ok=True)
-                target.write_bytes(p.read_bytes())
+            _link_or_copy(os.path.join(viewer_src, rel_path), target)
+        synced_dirs[str(preview_dir)] = sync_key
 
-    # 快速复制 EPUB 文件
+    # 把 EPUB 放进预览目录：优先硬链接（不复制任何字节），跨文件系统时退回 copyfile
+    # （Linux/macOS 在内核中完成复制）。EPUBBuilder.build 通过原子替换写出新文件，
+    # 不会改写已链接的旧 inode，所以预览不会读到写了一半的文件
     try:
-        epub_bytes = epub_path.read_bytes()
+        src_st = epub_path.stat()
         epub_target = preview_dir / "output.epub"
-        # 只在文件不存在或源文件更新时才复制
-        if not epub_target.exists() or epub_target.stat().st_mtime < epub_path.stat().st_mtime:
-            epub_target.write_bytes(epub_bytes)
+        try:
+            dst_st = epub_target.stat()
+        except FileNotFoundError:
+            dst_st = None
+        if dst_st is None or (not os.path.samestat(src_st, dst_st) and dst_st.st_mtime < src_st.st_mtime):
+            _link_or_copy(str(epub_path), epub_target)
+            print(f"[PREVIEW] EPUB ready: {src_st.st_size} bytes", flush=True)
     except FileNotFoundError:
         st.error("转换后 EPUB 文件未找到")
         return
@@ -412,9 +1018,31 @@ def render_epub_preview(epub_path: Path, work_dir: Path) -> None:
     )
 
 
+@st.cache_resource(max_entries=2)
+def _download_bytes(path: str, mtime_ns: int) -> bytes:
+    """
+    读取待下载文件的内容，按 (路径, mtime_ns) 缓存：
+    rerun 时复用同一个 bytes 对象，不再重新读盘和分配；文件重写后自动失效
+    """
+    return Path(path).read_bytes()
+
+
+def _session_work_dir() -> Path:
+    """
+    当前会话的工作目录。Streamlit 每次 rerun 都会重新执行脚本、重置模块全局变量，
+    所以临时目录放在 session_state 中，整个会话只创建一次，会话结束时随之清理
+    """
+    temp_dir = st.session_state.get("_temp_dir")
+    if temp_dir is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        # Stop the preview server when this temp dir goes away, unless a later
+        # session has already pointed the server at a different directory
+        weakref.finalize(temp_dir, _stop_static_server, str(Path(temp_dir.name) / "static"))
+        st.session_state["_temp_dir"] = temp_dir
+    return Path(temp_dir.name)
+
+
 def main() -> None:
-    global _TEMP_DIR
-    
     st.set_page_config(
         page_title="PDF → HTML",
         layout="centered",
@@ -431,34 +1059,24 @@ def main() -> None:
     if uploaded_file is None:
         return
 
-    # Create a persistent temp directory for this session
-    if _TEMP_DIR is None:
-        _TEMP_DIR = tempfile.TemporaryDirectory()
-    
-    tmpdir = _TEMP_DIR.name
-    work_dir = Path(tmpdir)
+    work_dir = _session_work_dir()
 
     pdf_path = work_dir / uploaded_file.name
     html_path = work_dir / "output.html"
 
-    pdf_path.write_bytes(uploaded_file.read())
+    # 同一个上传文件只写盘一次（rerun 时跳过）；getbuffer 直接引用上传内容，不复制
+    upload_key = (getattr(uploaded_file, "file_id", None), uploaded_file.name, uploaded_file.size)
+    if st.session_state.get("_written_upload") != upload_key or not pdf_path.exists():
+        pdf_path.write_bytes(uploaded_file.getbuffer())
+        st.session_state["_written_upload"] = upload_key
+        st.session_state.pop("_converted", None)
 
     # OCR选项
     st.sidebar.header("OCR 选项")
     
-    # 检查 poppler 是否可用
-    poppler_available = False
-    try:
-        result = subprocess.run(
-            ['pdftoppm', '-v'],
-            capture_output=True,
-            timeout=2
-        )
-        poppler_available = True
-    except (FileNotFoundError, subprocess.TimeoutExpired, ImportError):
-        poppler_available = False
-    
-    if not poppler_available:
+    # 检查 poppler 是否可用（PATH 查找，结果按进程缓存，rerun 时不再启动子进程）
+    has_poppler = poppler_available()
+    if not has_poppler:
         st.sidebar.warning(
             "⚠️ OCR 功能需要安装 poppler\n\n"
             "**macOS:**\n"
@@ -472,8 +1090,8 @@ def main() -> None:
     use_ocr = st.sidebar.checkbox(
         "启用 OCR（用于扫描版PDF）",
         value=False,
-        disabled=not poppler_available,
-        help="如果PDF是扫描版或文本提取效果差，可以启用OCR" if poppler_available else "需要先安装 poppler"
+        disabled=not has_poppler,
+        help="如果PDF是扫描版或文本提取效果差，可以启用OCR" if has_poppler else "需要先安装 poppler"
     )
     
     if use_ocr:
@@ -486,7 +1104,11 @@ def main() -> None:
     else:
         ocr_backend = "paddleocr"
 
-    if st.button("开始转换"):
+    # 同一文件、同一选项已转换过时不再重复转换，rerun（如点击下载）后直接展示结果
+    convert_key = upload_key + (use_ocr, ocr_backend)
+    converted = st.session_state.get("_converted") == convert_key and html_path.exists()
+
+    if st.button("开始转换") and not converted:
         st.subheader("HTML 在线预览（实时）")
         preview_placeholder = st.empty()
 
@@ -500,15 +1122,19 @@ def main() -> None:
             st.info("ℹ️ **提示**: PaddleOCR 首次初始化可能需要几分钟时间，请耐心等待。模型加载完成后会显示进度。")
 
         try:
-            pipeline = PDFToEPUBPipeline(
-                pdf_path=pdf_path,
-                output_path=html_path,
-                progress_callback=progress,
-                output_format="html",  # 使用HTML格式
-                use_ocr=use_ocr,
-                ocr_backend=ocr_backend,
-            )
-            pipeline.run()
+            # 构造流水线也可能失败（PDF 损坏、缺少 poppler），同样要停止进度线程
+            try:
+                pipeline = PDFToEPUBPipeline(
+                    pdf_path=pdf_path,
+                    output_path=html_path,
+                    progress_callback=progress,
+                    output_format="html",  # 使用HTML格式
+                    use_ocr=use_ocr,
+                    ocr_backend=ocr_backend,
+                )
+                pipeline.run()
+            finally:
+                progress.close()
         except RuntimeError as e:
             error_msg = str(e)
             if "poppler" in error_msg.lower():
@@ -527,12 +1153,15 @@ def main() -> None:
             st.code(traceback.format_exc())
             return
 
+        st.session_state["_converted"] = convert_key
+        converted = True
         st.success("转换完成")
 
+    if converted:
         # 下载按钮
         st.download_button(
             label="下载 HTML",
-            data=html_path.read_bytes(),
+            data=_download_bytes(str(html_path), html_path.stat().st_mtime_ns),
             file_name="output.html",
             mime="text/html",
         )